@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright 2026 Jonathan Schultz
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from argrecord import ArgumentHelper, ArgumentRecorder
+from datetime import datetime
+import dateutil.parser
+import sqlite3
+import hashlib
+import json
+import zlib
+import csv
+import sys
+
+# Archive of every version of the daily burns advertised by DBCA, and when each was advertised.
+#
+# Each distinct version of a burn is stored once, as compressed JSON keyed by burn_id and a hash
+# of its content, so a burn that returns to an earlier state reuses the earlier version. Each
+# period during which a version was advertised on a layer is an interval. Intervals are also held
+# in an R-tree, so the burns advertised at any time are found without scanning the whole history.
+# Versions are never removed; an interval is only changed once, when it is closed.
+
+ARCHIVE_TABLES = [
+    'CREATE TABLE IF NOT EXISTS versions (id INTEGER PRIMARY KEY, burn_id TEXT, hash BLOB NOT NULL, record BLOB NOT NULL, UNIQUE (burn_id, hash))',
+    'CREATE TABLE IF NOT EXISTS intervals (id INTEGER PRIMARY KEY, layer TEXT, version_id INTEGER NOT NULL REFERENCES versions, valid_from REAL NOT NULL, valid_to REAL)',
+    'CREATE INDEX IF NOT EXISTS intervals_version ON intervals (version_id)',
+    'CREATE INDEX IF NOT EXISTS intervals_open ON intervals (layer) WHERE valid_to IS NULL',
+    # R-tree coordinates are single precision, so it only narrows the search; times are then
+    # compared exactly. Open intervals end at OPEN_END.
+    'CREATE VIRTUAL TABLE IF NOT EXISTS intervals_rtree USING rtree(id, starttime, endtime)']
+
+OPEN_END = 1e12
+
+def timestamp(value):
+    if isinstance(value, str):
+        value = dateutil.parser.parse(value)
+    return value.timestamp()
+
+def isotime(value):
+    return datetime.fromtimestamp(value).astimezone().isoformat(timespec='seconds') if value is not None else ''
+
+class BurnsArchive:
+    def __init__(self, filename, layer=None):
+        self.layer = layer
+        self.conn = sqlite3.connect(filename)
+        with self.conn:
+            for statement in ARCHIVE_TABLES:
+                self.conn.execute(statement)
+
+        # Open interval id and version hash of each burn currently advertised on the layer
+        self.current = {burn_id: (interval_id, hash)
+                        for (burn_id, interval_id, hash) in self.conn.execute('SELECT burn_id, intervals.id, hash FROM intervals JOIN versions ON versions.id = version_id \
+                                                                               WHERE valid_to IS NULL AND layer IS ?', (layer,))}
+
+    # Record the burns advertised at a time, returning the numbers of intervals opened and closed
+    def record(self, burns, polltime):
+        polltime = timestamp(polltime)
+        burns = {burn.get('burn_id'): burn for burn in burns}
+        (opened, closed) = (0, 0)
+        with self.conn:
+            for (burn_id, burn) in burns.items():
+                record = json.dumps(burn, sort_keys=True).encode()
+                hash = hashlib.blake2b(record, digest_size=16).digest()
+                (interval_id, currenthash) = self.current.get(burn_id, (None, None))
+                if hash == currenthash:
+                    continue
+
+                if interval_id is not None:
+                    self.closeInterval(interval_id, polltime)
+                    closed += 1
+
+                self.conn.execute('INSERT OR IGNORE INTO versions (burn_id, hash, record) VALUES (?, ?, ?)', (burn_id, hash, zlib.compress(record, 9)))
+                (version_id,) = self.conn.execute('SELECT id FROM versions WHERE burn_id IS ? AND hash = ?', (burn_id, hash)).fetchone()
+                interval_id = self.conn.execute('INSERT INTO intervals (layer, version_id, valid_from) VALUES (?, ?, ?)', (self.layer, version_id, polltime)).lastrowid
+                self.conn.execute('INSERT INTO intervals_rtree VALUES (?, ?, ?)', (interval_id, polltime, OPEN_END))
+                self.current[burn_id] = (interval_id, hash)
+                opened += 1
+
+            for burn_id in [burn_id for burn_id in self.current if burn_id not in burns]:
+                self.closeInterval(self.current.pop(burn_id)[0], polltime)
+                closed += 1
+
+        return (opened, closed)
+
+    def closeInterval(self, interval_id, polltime):
+        self.conn.execute('UPDATE intervals SET valid_to = ? WHERE id = ?', (polltime, interval_id))
+        self.conn.execute('UPDATE intervals_rtree SET endtime = ? WHERE id = ?', (polltime, interval_id))
+
+    # Burns advertised at a time, optionally only on one layer
+    def stateAt(self, when, layer=None):
+        when = timestamp(when)
+        rows = self.conn.execute('SELECT layer, intervals.valid_from, intervals.valid_to, record FROM intervals_rtree \
+                                  JOIN intervals ON intervals.id = intervals_rtree.id JOIN versions ON versions.id = version_id \
+                                  WHERE starttime <= ? AND endtime >= ? \
+                                  AND intervals.valid_from <= ? AND (intervals.valid_to IS NULL OR intervals.valid_to > ?) \
+                                  AND (? IS NULL OR layer = ?) ORDER BY versions.burn_id', (when, when, when, when, layer, layer))
+        return [(layer, valid_from, valid_to, json.loads(zlib.decompress(record))) for (layer, valid_from, valid_to, record) in rows]
+
+    # Every version of a burn and when it was advertised, in time order
+    def history(self, burn_id):
+        rows = self.conn.execute('SELECT layer, valid_from, valid_to, record FROM versions JOIN intervals ON version_id = versions.id \
+                                  WHERE burn_id = ? ORDER BY valid_from', (burn_id,))
+        return [(layer, valid_from, valid_to, json.loads(zlib.decompress(record))) for (layer, valid_from, valid_to, record) in rows]
+
+    # Local times at which burns on the layer have changed, other than when they were first recorded
+    def changeTimes(self):
+        rows = self.conn.execute('SELECT valid_from FROM intervals WHERE layer IS ? AND valid_from > (SELECT MIN(valid_from) FROM intervals WHERE layer IS ?) \
+                                  UNION SELECT valid_to FROM intervals WHERE layer IS ? AND valid_to IS NOT NULL', (self.layer, self.layer, self.layer))
+        return [datetime.fromtimestamp(changetime) for (changetime,) in rows]
+
+    def close(self):
+        self.conn.close()
+
+def dailyBurnsArchive(arglist=None):
+    parser = ArgumentRecorder(description='Query a daily burns archive written by get_daily_burns.py.',
+                              fromfile_prefix_chars='@')
+
+    parser.add_argument('-v', '--verbosity',  type=int, default=1, private=True)
+
+    parser.add_argument('-a', '--archive',    type=str, required=True, help='Archive file', input=True)
+    parser.add_argument('-l', '--layer',      type=str, help='Only burns from this layer')
+    parser.add_argument('-T', '--time',       type=str, help='Output the burns advertised at this date/time, in any sensible format')
+    parser.add_argument('-b', '--burn-id',    type=str, help='Output every version of this burn')
+
+    parser.add_argument('-c', '--csvfile',    type=str, help='Output CSV file, otherwise use stdout.', output=True)
+    parser.add_argument('--no-comments',      action='store_true', help='Do not output descriptive comments')
+
+    args = parser.parse_args(arglist)
+    if (args.time is None) == (args.burn_id is None):
+        parser.error('Exactly one of --time and --burn-id is required')
+
+    archive = BurnsArchive(args.archive)
+    if args.time:
+        rows = archive.stateAt(args.time, args.layer)
+    else:
+        rows = [row for row in archive.history(args.burn_id) if args.layer is None or row[0] == args.layer]
+    archive.close()
+
+    fieldnames = ['layer', 'valid_from', 'valid_to']
+    for (layer, valid_from, valid_to, record) in rows:
+        fieldnames += [fieldname for fieldname in record if fieldname not in fieldnames]
+
+    csvfile = open(args.csvfile, 'w') if args.csvfile else sys.stdout
+    if not args.no_comments:
+        parser.write_comments(args, csvfile, incomments=ArgumentHelper.separator())
+
+    csvwriter = csv.DictWriter(csvfile, fieldnames=fieldnames)
+    csvwriter.writeheader()
+    for (layer, valid_from, valid_to, record) in rows:
+        csvwriter.writerow({**record, 'layer': layer, 'valid_from': isotime(valid_from), 'valid_to': isotime(valid_to)})
+
+    if args.csvfile:
+        csvfile.close()
+
+if __name__ == '__main__':
+    dailyBurnsArchive(None)
@@ -19,57 +19,150 @@
 from argrecord import ArgumentHelper, ArgumentRecorder
 import urllib3
 from owslib.wms import WebMapService
-from owslib.util import Authentication
 from fp.fp import FreeProxy, FreeProxyException
-from bs4 import BeautifulSoup
-from shapely.geometry import Polygon, MultiPolygon
+from lxml import etree
+import shapely
+import numpy
+import psycopg
+from psycopg import sql
+from pyproj import CRS
+import sqlite3
+import struct
+
+from daily_burns_archive import BurnsArchive
 import csv
+import io
+import hashlib
+import re
 from datetime import datetime
 import dateutil.parser
 import time
 import sys
 import os
 import shutil
+import asyncio
+import threading
+import requests
+import queue
 
 # Force IPv4 since IPv6 requests seem to fail
 import requests.packages.urllib3.util.connection
 requests.packages.urllib3.util.connection.HAS_IPV6 = False
 
-def getDailyBurns(arglist=None):
-    parser = ArgumentRecorder(description='Read Daily Burns from DBCA WMS server, stopping a change is detected.',
-                              fromfile_prefix_chars='@')
+# Returned by fetchDailyBurns when the feed has not changed since it was last decoded
+UNCHANGED = 'unchanged'
+
+GEORSS_POLYGON = '{http://www.georss.org/georss}polygon'
+
+# Spans without nested markup, entities or carriage returns, whose text can be taken as it stands
+SPAN_PATTERN = re.compile(r'<span\b[^>]*>([^<&\r]*)</span>')
+DESCRIPTION_PARSER = etree.XMLParser(recover=True)
+
+def float2str(s):
+    try:
+        return str(float(s))
+    except:
+        return ''
+
+# Text consisting only of ASCII whitespace is collapsed to a newline if it contains one, otherwise
+# to a single space, as BeautifulSoup does to each text node
+ASCII_SPACES = ' \n\t\f\r'
+
+def collapseSpace(text):
+    if text and not text.strip(ASCII_SPACES):
+        return '\n' if '\n' in text else ' '
+    return text
+
+# Return the text of each span in an item description, in document order
+def descriptionSpans(description):
+    spans = SPAN_PATTERN.findall(description)
+    if len(spans) == description.count('<span') and '&' not in description and '\r' not in description:
+        return [collapseSpace(span) for span in spans]
+
+    root = etree.fromstring(('<description>' + description + '</description>').encode(), DESCRIPTION_PARSER)
+    return [''.join(collapseSpace(text) for text in span.itertext()) for span in root.iter('span')] if root is not None else []
+
+# Decode a georss polygon, a list of latitude longitude pairs, into an array of (longitude, latitude)
+def decodeRing(text):
+    values = numpy.array(text.split(), dtype=float)
+    return values[:len(values) // 2 * 2].reshape(-1, 2)[:,::-1]
+
+# Parse the daily burns RSS returned by the WMS server, one item at a time. A burn is described by
+# one item, followed by any further items holding more of its polygons. With geometry, each burn's
+# polygons are kept as WKT in its 'geom' field, all burns' geometries being built at once.
+def parseDailyBurns(rssfile, geometry=False):
+    rc = []
+    multipolygon = []
+    rings = []
+    ringburns = []
+
+    for (event, item) in etree.iterparse(rssfile, events=('end',), tag='item', recover=True):
+        spans = descriptionSpans(''.join(item.find('.//description').itertext()))
+        if len(spans) > 0:
+            if multipolygon != []:
+                rings += multipolygon
+                ringburns += [len(rc)] * len(multipolygon)
+                multipolygon = []
+
+                rc += [attributes]
+
+            attributes = {}
+            for n in range(len(spans) // 2):
+                attributes[spans[2 * n]] = spans[2 * n + 1]
+
+            attributes['location'] = f"{attributes.get('location')}"
+            attributes['burn_purpose'] = ', '.join(sorted(list(map(str.strip, attributes.get('burn_purpose').split(',')))))
+            attributes['burn_target_date'] = str(dateutil.parser.parse(attributes.get('burn_target_date_raw')).date())
+            del attributes['burn_target_date_raw']
+            attributes['indicative_area']  = float2str(attributes.get('indicative_area'))
+            if attributes['indicative_area'] != '':
+                attributes['indicative_area'] = str(round(float(attributes['indicative_area'])))
+            attributes['burn_target_long'] = float2str(attributes.get('burn_target_long'))
+            if attributes['burn_target_long'] != '':
+                attributes['burn_target_long'] = str(round(float(attributes['burn_target_long']),8))
+            attributes['burn_target_lat']  = float2str(attributes.get('burn_target_lat'))
+            if attributes['burn_target_lat'] != '':
+                attributes['burn_target_lat'] = str(round(float(attributes['burn_target_lat']),8))
+            attributes['burn_planned_area_today'] = float2str(attributes.get('burn_planned_area_today'))
+            try:
+                attributes['burn_est_start'] = str(dateutil.parser.parse(attributes.get('burn_est_start', '')).time())
+            except:
+                pass
 
-    parser.add_argument('-v', '--verbosity',  type=int, default=1, private=True)
+        multipolygon += [decodeRing(''.join(item.find('.//' + GEORSS_POLYGON).itertext())) if geometry else None]
 
-    parser.add_argument('-s', '--server',     type=str,
-                                              default='https://kmi.dpaw.wa.gov.au/geoserver/public/wms')
-    parser.add_argument('-V', '--version',    type=str,
-                                              default='1.1.1')
-    parser.add_argument('-p', '--proxy',      type=str, help='Proxy URL or "free" to use free-proxy'),
-    parser.add_argument('-l', '--layer',      type=str,
-                                              default='public:todays_burns')
-    parser.add_argument('-c', '--csvfile',    type=str,
-                                              help='Output CSV file, otherwise use stdout.', output=True)
-    parser.add_argument('-i', '--interval',   type=int, default=60,
-                                              help='Polling interval.')
-    parser.add_argument('-t', '--timeout',    type=int, default=30,
-                                              help='Timeout for WMS request.')
-    parser.add_argument('-F', '--fields',     type=str, nargs='+', help='Ordered list of fields',
-                        default=['burn_id','location','indicative_area','burn_purpose','burn_planned_area_today','burn_stat','burn_est_start','burn_target_lat','burn_target_long'])
+        # Free items already processed
+        item.clear()
+        while item.getprevious() is not None:
+            del item.getparent()[0]
 
+    if multipolygon != []:
+        rings += multipolygon
+        ringburns += [len(rc)] * len(multipolygon)
+        multipolygon = []
 
-    parser.add_argument('--no-comments',      action='store_true', help='Do not output descriptive comments')
-    parser.add_argument('--no-header',        action='store_true', help='Do not output CSV header with column names')
+        rc += [attributes]
 
-    args = parser.parse_args(arglist)
+    if geometry and rings:
+        ringidxs = numpy.repeat(numpy.arange(len(rings)), [len(ring) for ring in rings])
+        polygons = shapely.polygons(shapely.linearrings(numpy.concatenate(rings), indices=ringidxs))
+        ringburns = numpy.array(ringburns)
+        # A burn with one polygon is a Polygon, otherwise a MultiPolygon
+        counts = numpy.bincount(ringburns, minlength=len(rc))
+        firsts = numpy.searchsorted(ringburns, numpy.arange(len(rc)))
+        geoms = numpy.where(counts == 1, polygons[numpy.minimum(firsts, len(polygons) - 1)], shapely.multipolygons(polygons, indices=ringburns))
+        for (attributes, wkt) in zip(rc, shapely.to_wkt(geoms, rounding_precision=-1)):
+            attributes['geom'] = wkt
 
-    csv.field_size_limit(sys.maxsize)
+    return rc
 
+# Read a daily burns CSV file written by this script, returning its comments, field names and rows
+def readBurnsCSV(filename):
     incomments = None
     infieldnames = []
     indata = []
-    if args.csvfile is not None and os.path.exists(args.csvfile):
-        infile = open(args.csvfile, 'r')
+    if filename is not None and os.path.exists(filename):
+        infile = open(filename, 'r')
         incomments = ArgumentHelper.read_comments(infile) or ArgumentHelper.separator()
         try:
             infieldnames = next(csv.reader([next(infile)]))
@@ -79,163 +172,768 @@ def getDailyBurns(arglist=None):
         except StopIteration:
             pass
 
+    return (incomments, infieldnames, indata)
 
-    def float2str(s):
-        try:
-            return str(float(s))
-        except:
-            return ''
+# Key burns by burn_id, holding each burn's values of the given fields. A later burn with the
+# same burn_id replaces an earlier one.
+def keyBurns(data, fieldnames):
+    return {item.get('burn_id'): {fieldname: item.get(fieldname) or '' for fieldname in fieldnames} for item in data}
 
-    def decodeDailyBurns(wms):
-        rc = []
+# Inserts, updates and deletes that turn one set of keyed burns into another, as a list of
+# (change, burn) holding the new burn, or for a delete the old one
+def burnsDelta(inburns, outburns):
+    changes  = [('insert', burn) for (burn_id, burn) in outburns.items() if burn_id not in inburns]
+    changes += [('update', burn) for (burn_id, burn) in outburns.items() if burn_id in inburns and burn != inburns[burn_id]]
+    changes += [('delete', burn) for (burn_id, burn) in inburns.items() if burn_id not in outburns]
+    return changes
 
-        try:
-            img=wms.getmap( layers=[args.layer], bbox=(108.0,-45.0,155.0,-10.0), size=(768,571), srs='EPSG:4283', format='rss', timeout=args.timeout )
-        except:
-            return None
+# Add any fields of decoded burns that are not in the list of fields, in place
+def burnsFieldnames(fields, outdata):
+    fields += list(set(sum([list(item.keys()) for item in outdata], start=[])) - set(fields))
+    return fields
 
-        data = BeautifulSoup(img.read(), 'xml')
-        # print(data.prettify())
+# Compare decoded burns with those last written. Returns the field names to write them with if
+# they have changed, otherwise None. Burns are matched by burn_id, so their order is ignored.
+def burnsChange(fields, infieldnames, indata, outdata, verbosity):
+    outfieldnames = burnsFieldnames(fields, outdata)
 
-        items = data.find_all('item')
-        multipolygon = []
+    if set(outfieldnames) != set(infieldnames):
+        return outfieldnames
+
+    changes = burnsDelta(keyBurns(indata, outfieldnames), keyBurns(outdata, outfieldnames))
+    if changes:
+        if verbosity >= 2:
+            print(changes, file=sys.stderr)
+        return outfieldnames
 
-        for item in items:
-            description = BeautifulSoup('<description>' + item.find("description").get_text() + '</description>', 'xml')
-            spans = description.find_all("span")
-            if len(spans) > 0:
-                if multipolygon != []:
-                    # attributes['geom'] = multipolygon[0].wkt if len(multipolygon) == 1 else MultiPolygon(multipolygon).wkt
-                    multipolygon = []
-
-                    rc += [attributes]
-
-                attributes = {}
-                for n in range(len(spans) // 2):
-                    attributes[spans[2 * n].get_text()] = spans[2 * n + 1].get_text()
-
-                attributes['location'] = f"{attributes.get('location')}"
-                attributes['burn_purpose'] = ', '.join(sorted(list(map(str.strip, attributes.get('burn_purpose').split(',')))))
-                attributes['burn_target_date'] = str(dateutil.parser.parse(attributes.get('burn_target_date_raw')).date())
-                del attributes['burn_target_date_raw']
-                attributes['indicative_area']  = float2str(attributes.get('indicative_area'))
-                if attributes['indicative_area'] != '':
-                    attributes['indicative_area'] = str(round(float(attributes['indicative_area'])))
-                attributes['burn_target_long'] = float2str(attributes.get('burn_target_long'))
-                if attributes['burn_target_long'] != '':
-                    attributes['burn_target_long'] = str(round(float(attributes['burn_target_long']),8))
-                attributes['burn_target_lat']  = float2str(attributes.get('burn_target_lat'))
-                if attributes['burn_target_lat'] != '':
-                    attributes['burn_target_lat'] = str(round(float(attributes['burn_target_lat']),8))
-                attributes['burn_planned_area_today'] = float2str(attributes.get('burn_planned_area_today'))
-                try:
-                    attributes['burn_est_start'] = str(dateutil.parser.parse(attributes.get('burn_est_start', '')).time())
-                except:
-                    pass
-
-            valiter = iter([float(val) for val in item.find("georss:polygon").get_text().split(' ')])
-            polygon = Polygon([(lat, lon) for lat, lon in zip(valiter, valiter)])
-            multipolygon += [polygon]
-
-        if multipolygon != []:
-            # attributes['geom'] = multipolygon[0].wkt if len(multipolygon) == 1 else MultiPolygon(multipolygon).wkt
-            multipolygon = []
-
-            rc += [attributes]
-
-        return rc
+    return None
 
+def writeBurnsCSV(parser, args, filename, incomments, outfieldnames, outdata):
+    if filename is not None:
+        if os.path.exists(filename):
+            shutil.move(filename, filename + '.bak')
+
+        csvfile = open(filename, 'w')
+    else:
+        csvfile = sys.stdout
+
+    if not args.no_comments:
+        parser.write_comments(args, csvfile, incomments=incomments)
+
+    csvwriter=csv.DictWriter(csvfile, fieldnames=outfieldnames)
+    csvwriter.writeheader()
+    for item in outdata:
+        csvwriter.writerow(item)
+
+    if filename is not None:
+        csvfile.close()
+
+CHANGE_FIELDS = ['change_time', 'change']
+
+# Daily burns keyed by burn_id, kept in a CSV change log. Each poll that changes the burns appends
+# a row for each burn inserted, updated or deleted, stamped with the poll time. Compacting the
+# log rewrites it as one 'snapshot' row per current burn; this also happens when new fields appear.
+class BurnsLog:
+    def __init__(self, filename, fields, compact=None):
+        self.filename = filename
+        self.compact  = compact
+        (self.comments, logfieldnames, logrows) = readBurnsCSV(filename)
+        self.fields = [fieldname for fieldname in logfieldnames if fieldname not in CHANGE_FIELDS] or list(fields)
+
+        # A plain burns CSV, as written without a change log, is read as a snapshot and rewritten
+        # with the change columns before any change is appended to it
+        self.plain = bool(logfieldnames) and 'change' not in logfieldnames
+
+        self.burns = {}
+        self.changecount = 0
+        self.changetimes = set()
+        for row in logrows:
+            burn = {fieldname: row.get(fieldname) or '' for fieldname in self.fields}
+            change = row.get('change') or 'snapshot'
+            if change == 'delete':
+                self.burns.pop(burn['burn_id'], None)
+            else:
+                self.burns[burn['burn_id']] = burn
+            if change != 'snapshot':
+                self.changecount += 1
+                self.changetimes.add(row['change_time'])
+
+    # Log the changes from the current burns to decoded burns, returning the list of changes
+    def update(self, parser, args, outdata, changetime):
+        newfields = len(self.fields) != len(burnsFieldnames(self.fields, outdata))
+        outburns = keyBurns(outdata, self.fields)
+        if newfields:
+            self.burns = keyBurns(self.burns.values(), self.fields)
+
+        changes = burnsDelta(self.burns, outburns)
+        self.burns = outburns
+        changetime = changetime.astimezone().isoformat(timespec='seconds')
+        if newfields or self.plain or not os.path.exists(self.filename) or (self.compact and self.changecount + len(changes) >= self.compact):
+            self.snapshot(parser, args, changetime)
+        elif changes:
+            with open(self.filename, 'a') as logfile:
+                logwriter = csv.DictWriter(logfile, fieldnames=CHANGE_FIELDS + self.fields)
+                for (change, burn) in changes:
+                    logwriter.writerow({'change_time': changetime, 'change': change, **burn})
+            self.changecount += len(changes)
+
+        return changes
+
+    # Rewrite the log as a snapshot of the current burns, replacing it only once it is complete
+    def snapshot(self, parser, args, changetime):
+        with open(self.filename + '.tmp', 'w') as logfile:
+            if not args.no_comments:
+                parser.write_comments(args, logfile, incomments=self.comments)
+
+            logwriter = csv.DictWriter(logfile, fieldnames=CHANGE_FIELDS + self.fields)
+            logwriter.writeheader()
+            for burn in self.burns.values():
+                logwriter.writerow({'change_time': changetime, 'change': 'snapshot', **burn})
+
+        os.replace(self.filename + '.tmp', self.filename)
+        self.changecount = 0
+        self.plain = False
+
+GEOMETRY_SRID = 4283
+
+# GeoPackage geometry header: magic, version, flags (little-endian with an xy envelope), srs id
+# and envelope (minx, maxx, miny, maxy)
+GPKG_HEADER = struct.Struct('<2sBBi4d')
+
+GPKG_TABLES = [
+    'CREATE TABLE IF NOT EXISTS gpkg_spatial_ref_sys (srs_name TEXT NOT NULL, srs_id INTEGER PRIMARY KEY, organization TEXT NOT NULL, \
+                                                      organization_coordsys_id INTEGER NOT NULL, definition TEXT NOT NULL, description TEXT)',
+    "CREATE TABLE IF NOT EXISTS gpkg_contents (table_name TEXT NOT NULL PRIMARY KEY, data_type TEXT NOT NULL, identifier TEXT UNIQUE, description TEXT DEFAULT '', \
+                                               last_change DATETIME NOT NULL DEFAULT (strftime('%Y-%m-%dT%H:%M:%fZ','now')), \
+                                               min_x DOUBLE, min_y DOUBLE, max_x DOUBLE, max_y DOUBLE, srs_id INTEGER)",
+    'CREATE TABLE IF NOT EXISTS gpkg_geometry_columns (table_name TEXT NOT NULL, column_name TEXT NOT NULL, geometry_type_name TEXT NOT NULL, \
+                                                       srs_id INTEGER NOT NULL, z TINYINT NOT NULL, m TINYINT NOT NULL, PRIMARY KEY (table_name, column_name))',
+    'CREATE TABLE IF NOT EXISTS gpkg_extensions (table_name TEXT, column_name TEXT, extension_name TEXT NOT NULL, definition TEXT NOT NULL, \
+                                                 scope TEXT NOT NULL, UNIQUE (table_name, column_name, extension_name))']
+
+def quoteIdentifier(name):
+    return '"' + name.replace('"', '""') + '"'
+
+# Write burn geometries to a GeoPackage table with an R-tree spatial index, creating them if
+# needed. Burns replace any earlier version with the same burn_id and target date.
+def writeGeoPackage(filename, table, fieldnames, burns):
+    geoms = shapely.from_wkt([burn.get('geom') or None for burn in burns])
+    bounds = shapely.bounds(geoms)
+    blobs = [GPKG_HEADER.pack(b'GP', 0, 3, GEOMETRY_SRID, minx, maxx, miny, maxy) + wkb if wkb is not None else None
+             for (wkb, (minx, miny, maxx, maxy)) in zip(shapely.to_wkb(geoms), bounds)]
+    rtree = quoteIdentifier('rtree_' + table + '_geom')
+    table = quoteIdentifier(table)
+
+    conn = sqlite3.connect(filename)
+    with conn:
+        conn.execute('PRAGMA application_id = 1196444487')
+        conn.execute('PRAGMA user_version = 10300')
+        for statement in GPKG_TABLES:
+            conn.execute(statement)
+        conn.executemany('INSERT OR IGNORE INTO gpkg_spatial_ref_sys VALUES (?, ?, ?, ?, ?, ?)',
+                         [('Undefined cartesian SRS', -1, 'NONE', -1, 'undefined', None),
+                          ('Undefined geographic SRS', 0, 'NONE', 0, 'undefined', None)] +
+                         [(crs.name, srid, 'EPSG', srid, crs.to_wkt('WKT1_GDAL'), None) for (srid, crs) in ((srid, CRS.from_epsg(srid)) for srid in (4326, GEOMETRY_SRID))])
+
+        conn.execute('CREATE TABLE IF NOT EXISTS ' + table + ' (fid INTEGER PRIMARY KEY AUTOINCREMENT, geom GEOMETRY, burn_id TEXT, burn_target_date TEXT, \
+                                                                UNIQUE (burn_id, burn_target_date))')
+        conn.execute('CREATE VIRTUAL TABLE IF NOT EXISTS ' + rtree + ' USING rtree(id, minx, maxx, miny, maxy)')
+        tablename = table[1:-1].replace('""', '"')
+        conn.execute("INSERT OR IGNORE INTO gpkg_contents (table_name, data_type, identifier, srs_id) VALUES (?, 'features', ?, ?)", (tablename, tablename, GEOMETRY_SRID))
+        conn.execute("INSERT OR IGNORE INTO gpkg_geometry_columns VALUES (?, 'geom', 'GEOMETRY', ?, 0, 0)", (tablename, GEOMETRY_SRID))
+        conn.execute("INSERT OR IGNORE INTO gpkg_extensions VALUES (?, 'geom', 'gpkg_rtree_index', 'http://www.geopackage.org/spec120/#extension_rtree', 'write-only')", (tablename,))
+
+        columns = [row[1] for row in conn.execute('PRAGMA table_info(' + table + ')')]
+        for fieldname in fieldnames:
+            if fieldname not in columns:
+                conn.execute('ALTER TABLE ' + table + ' ADD COLUMN ' + quoteIdentifier(fieldname) + ' TEXT')
+
+        keys = [(burn.get('burn_id'), burn.get('burn_target_date')) for burn in burns]
+        conn.executemany('DELETE FROM ' + rtree + ' WHERE id IN (SELECT fid FROM ' + table + ' WHERE burn_id = ? AND burn_target_date = ?)', keys)
+        conn.executemany('DELETE FROM ' + table + ' WHERE burn_id = ? AND burn_target_date = ?', keys)
+
+        firstfid = conn.execute('SELECT COALESCE(MAX(fid), 0) + 1 FROM ' + table).fetchone()[0]
+        fids = range(firstfid, firstfid + len(burns))
+        conn.executemany('INSERT INTO ' + table + ' (fid, geom, ' + ', '.join(quoteIdentifier(fieldname) for fieldname in fieldnames) + ') VALUES (' + ', '.join(['?'] * (len(fieldnames) + 2)) + ')',
+                         [[fid, blob] + [burn.get(fieldname) for fieldname in fieldnames] for (fid, blob, burn) in zip(fids, blobs, burns)])
+        conn.executemany('INSERT INTO ' + rtree + ' VALUES (?, ?, ?, ?, ?)',
+                         [(fid, minx, maxx, miny, maxy) for (fid, blob, (minx, miny, maxx, maxy)) in zip(fids, blobs, bounds) if blob is not None])
+
+        conn.execute("UPDATE gpkg_contents SET (min_x, min_y, max_x, max_y) = (SELECT MIN(minx), MIN(miny), MAX(maxx), MAX(maxy) FROM " + rtree + "), \
+                                               last_change = strftime('%Y-%m-%dT%H:%M:%fZ','now') WHERE table_name = ?", (tablename,))
+
+    conn.close()
+
+# Write burn geometries to a PostGIS table with a GiST index, creating them if needed. Burns are
+# copied into a staging table and then replace any earlier version with the same burn_id and
+# target date.
+def writePostGIS(conninfo, table, fieldnames, burns):
+    geoms = shapely.set_srid(shapely.from_wkt([burn.get('geom') or None for burn in burns]), GEOMETRY_SRID)
+    fieldnames = [fieldname for fieldname in fieldnames if fieldname not in ('burn_id', 'burn_target_date')]
+
+    with psycopg.connect(conninfo) as conn:
+        conn.execute(sql.SQL('CREATE TABLE IF NOT EXISTS {} (burn_id TEXT NOT NULL, burn_target_date DATE NOT NULL, geom geometry(Geometry, {}), \
+                                                             PRIMARY KEY (burn_id, burn_target_date))').format(sql.Identifier(table), GEOMETRY_SRID))
+        conn.execute(sql.SQL('CREATE INDEX IF NOT EXISTS {} ON {} USING GIST (geom)').format(sql.Identifier(table + '_geom'), sql.Identifier(table)))
+
+        columns = [row[0] for row in conn.execute('SELECT column_name FROM information_schema.columns WHERE table_name = %s', (table,))]
+        for fieldname in fieldnames:
+            if fieldname not in columns:
+                conn.execute(sql.SQL('ALTER TABLE {} ADD COLUMN {} TEXT').format(sql.Identifier(table), sql.Identifier(fieldname)))
+
+        columns = [sql.Identifier(column) for column in ['burn_id', 'burn_target_date', 'geom'] + fieldnames]
+        conn.execute(sql.SQL('CREATE TEMPORARY TABLE staging (LIKE {}) ON COMMIT DROP').format(sql.Identifier(table)))
+        with conn.cursor().copy(sql.SQL('COPY staging ({}) FROM STDIN').format(sql.SQL(', ').join(columns))) as copy:
+            for (burn, wkb) in zip(burns, shapely.to_wkb(geoms, hex=True, include_srid=True)):
+                copy.write_row([burn.get('burn_id'), burn.get('burn_target_date'), wkb] + [burn.get(fieldname) for fieldname in fieldnames])
+
+        conn.execute(sql.SQL('INSERT INTO {} ({}) SELECT {} FROM staging \
+                              ON CONFLICT (burn_id, burn_target_date) DO UPDATE SET {}').format(
+                         sql.Identifier(table), sql.SQL(', ').join(columns), sql.SQL(', ').join(columns),
+                         sql.SQL(', ').join(sql.SQL('{} = EXCLUDED.{}').format(column, column) for column in columns[2:])))
+
+# Write burn geometries to a GeoPackage file or, given a PostgreSQL connection string, a PostGIS table
+def writeGeometries(args, fieldnames, burns):
+    fieldnames = [fieldname for fieldname in fieldnames if fieldname != 'geom']
+    burns = list({(burn.get('burn_id'), burn.get('burn_target_date')): burn for burn in burns}.values())
+    if args.geometry_out.endswith('.gpkg'):
+        writeGeoPackage(args.geometry_out, args.geometry_table, fieldnames, burns)
+    else:
+        writePostGIS(args.geometry_out, args.geometry_table, fieldnames, burns)
+
+# Validators for conditional requests, and digest of the last response body decoded, for a feed
+class FeedState:
+    def __init__(self):
+        self.etag         = None
+        self.lastmodified = None
+        self.digest       = None
+
+    def headers(self, headers=None):
+        headers = dict(headers or {})
+        if self.etag:
+            headers['If-None-Match'] = self.etag
+        if self.lastmodified:
+            headers['If-Modified-Since'] = self.lastmodified
+        return headers
+
+    # Return the body of a response, or UNCHANGED if it is the same as when last decoded
+    def check(self, status, headers, body):
+        if status == 304:
+            return UNCHANGED
+
+        self.etag         = headers.get('ETag')
+        self.lastmodified = headers.get('Last-Modified')
+
+        digest = hashlib.blake2b(body).digest()
+        if digest == self.digest:
+            return UNCHANGED
+        self.digest = digest
+
+        return body
+
+# A WMS layer polled for daily burns, and the CSV file its burns are written to
+class BurnsTarget:
+    def __init__(self, server, layer, csvfile, interval, fields, changelog=False, compact=None, archive=None):
+        self.server    = server
+        self.layer     = layer
+        self.csvfile   = csvfile
+        self.interval  = interval
+        self.fields    = list(fields)
+        self.feedstate = FeedState()
+        self.burnslog  = BurnsLog(csvfile, fields, compact) if changelog else None
+        self.archive   = BurnsArchive(archive, layer) if archive else None
+        if not changelog:
+            (self.incomments, self.infieldnames, self.indata) = readBurnsCSV(csvfile)
+
+# HTTP session kept open across polls, so that connections and TLS sessions are reused
+def burnsSession(args, poolsize=1):
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_maxsize=poolsize)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
     if args.proxy:
-        auth = Authentication(verify=False)
+        session.verify = False
         urllib3.disable_warnings()
         if args.proxy != 'free':
-            os.environ['http_proxy']  = args.proxy
-            os.environ['https_proxy'] = args.proxy
-        else:
-            fp = FreeProxy(https=True, rand=True, timeout=2)
-    else:
-        auth = Authentication()
+            session.proxies = {'http': args.proxy, 'https': args.proxy}
+
+    return session
+
+# Parsed capabilities of WMS servers, fetched through a session and kept for a time to live so
+# that each poll costs a single GetMap request
+class CapabilitiesCache:
+    def __init__(self, session, ttl):
+        self.session = session
+        self.ttl     = ttl
+        self.entries = {}
+
+    def get(self, server, version, timeout, proxies=None):
+        entry = self.entries.get((server, version))
+        if entry is None or time.monotonic() - entry[0] > self.ttl:
+            response = self.session.get(server, params={'service': 'WMS', 'version': version, 'request': 'GetCapabilities'},
+                                        timeout=timeout, proxies=proxies)
+            response.raise_for_status()
+            entry = (time.monotonic(), WebMapService(server, version=version, xml=response.content))
+            self.entries[(server, version)] = entry
+
+        return entry[1]
+
+    def invalidate(self, server, version):
+        self.entries.pop((server, version), None)
+
+# GetMap request parameters, as built by owslib for the same request
+def getmapParams(layer, version):
+    return {'service': 'WMS', 'version': version, 'request': 'GetMap', 'layers': layer, 'styles': '',
+            ('crs' if version == '1.3.0' else 'srs'): 'EPSG:4283',
+            'bbox': '-45.0,108.0,-10.0,155.0' if version == '1.3.0' else '108.0,-45.0,155.0,-10.0',
+            'width': '768', 'height': '571', 'format': 'rss', 'transparent': 'FALSE', 'bgcolor': '0xFFFFFF',
+            'exceptions': 'application/vnd.ogc.se_xml'}
+
+# Fetch and decode the daily burns of a WMS layer, or return UNCHANGED. If the request fails the
+# server's cached capabilities are dropped, in case it has moved its GetMap endpoint.
+def fetchDailyBurns(session, capabilities, server, layer, version, feedstate, timeout, proxies=None, geometry=False):
+    try:
+        wms = capabilities.get(server, version, timeout, proxies)
+        getmapurl = next((method['url'] for method in wms.getOperationByName('GetMap').methods if method['type'].lower() == 'get'), server)
+
+        response = session.get(getmapurl, params=getmapParams(layer, version), headers=feedstate.headers(), timeout=timeout, proxies=proxies)
+        response.raise_for_status()
+        if response.headers.get('Content-Type', '').split(';')[0] == 'application/vnd.ogc.se_xml':
+            raise RuntimeError(response.text)
+    except:
+        capabilities.invalidate(server, version)
+        raise
+
+    body = feedstate.check(response.status_code, response.headers, response.content)
+    return UNCHANGED if body is UNCHANGED else parseDailyBurns(io.BytesIO(body), geometry)
+
+# Free proxies found in the background and scored by the latency and success of requests made
+# through them, so that a poll can start at once with the healthiest proxy known. Candidates are
+# checked concurrently against the WMS server; proxies that keep failing are evicted and not
+# taken back until an hour has passed.
+class ProxyPool:
+    def __init__(self, server, size=8, timeout=5, verbosity=1):
+        self.server    = server
+        self.size      = size
+        self.timeout   = timeout
+        self.verbosity = verbosity
+        self.fp        = FreeProxy(https=True, rand=True, timeout=timeout)
+        self.proxies   = {}     # proxy: [successes, failures, consecutive failures, latency]
+        self.evicted   = {}     # proxy: eviction time
+        self.condition = threading.Condition()
+        self.candidates = queue.Queue()
+        for thread in range(size):
+            threading.Thread(target=self.checker, daemon=True).start()
+        threading.Thread(target=self.refill, daemon=True).start()
+
+    def score(self, stats):
+        (successes, failures, consecutive, latency) = stats
+        return (successes + 1) / (successes + failures + 2) / max(latency, 0.01)
+
+    # Return the healthiest proxy, waiting for one to be found if the pool is empty
+    def get(self):
+        with self.condition:
+            self.condition.wait_for(lambda: self.proxies)
+            return max(self.proxies, key=lambda proxy: self.score(self.proxies[proxy]))
+
+    # Record the outcome of a request through a proxy, evicting it if it keeps failing
+    def record(self, proxy, success, latency=None):
+        with self.condition:
+            stats = self.proxies.get(proxy)
+            if stats is None:
+                return
+
+            if success:
+                stats[0] += 1
+                stats[2] = 0
+                stats[3] = 0.7 * stats[3] + 0.3 * latency
+            else:
+                stats[1] += 1
+                stats[2] += 1
+
+            if stats[2] >= 2 or (stats[0] + stats[1] >= 4 and stats[1] > stats[0]):
+                if self.verbosity >= 2:
+                    print("Evicting proxy", proxy, file=sys.stderr)
+                del self.proxies[proxy]
+                self.evicted[proxy] = time.monotonic()
+                self.condition.notify_all()
+
+    def check(self, proxy):
+        starttime = time.monotonic()
+        try:
+            with requests.get(self.server, params={'service': 'WMS', 'request': 'GetCapabilities'}, proxies={'http': proxy, 'https': proxy},
+                              timeout=self.timeout, verify=False, stream=True) as response:
+                if response.status_code < 400:
+                    return (proxy, time.monotonic() - starttime)
+        except requests.exceptions.RequestException:
+            pass
 
-    lastpolltime = None
+        return (proxy, None)
+
+    def full(self):
+        return len(self.proxies) >= self.size
+
+    # Check candidates concurrently, adding those that work to the pool until it is full
+    def checker(self):
+        while True:
+            proxy = self.candidates.get()
+            with self.condition:
+                full = self.full()
+            latency = self.check(proxy)[1] if not full else None
+            if latency is not None:
+                with self.condition:
+                    added = not self.full()
+                    if added:
+                        self.proxies[proxy] = [0, 0, 0, latency]
+                        self.condition.notify_all()
+                if added and self.verbosity >= 2:
+                    print("Found free proxy", proxy, "latency", round(latency, 2), file=sys.stderr)
+
+            self.candidates.task_done()
+
+    # Keep the pool topped up with working proxies
+    def refill(self):
+        repeat = False
+        while True:
+            with self.condition:
+                self.condition.wait_for(lambda: not self.full())
+                now = time.monotonic()
+                self.evicted = {proxy: evicttime for (proxy, evicttime) in self.evicted.items() if now - evicttime < 3600}
+                found = len(self.proxies)
 
+            try:
+                candidates = ['http://' + address for address in self.fp.get_proxy_list(repeat)]
+            except FreeProxyException as e:
+                if self.verbosity >= 2:
+                    print(e, file=sys.stderr)
+                time.sleep(self.timeout)
+                continue
+
+            for proxy in candidates:
+                if proxy not in self.proxies and proxy not in self.evicted:
+                    self.candidates.put(proxy)
+            self.candidates.join()
+
+            # Try the larger list next time if this one yielded nothing
+            with self.condition:
+                found = len(self.proxies) > found
+            repeat = not found and not repeat
+            if not found:
+                time.sleep(self.timeout)
+
+HOURS_PER_WEEK = 168
+
+# Polling interval for each hour of the week, learned from when burns have changed. Changes are
+# counted in each hour of the week, and divided by the number of times that hour has been observed
+# to give a rate, smoothed across neighbouring hours and towards the overall rate. An hour of
+# average rate is polled at the base interval, busier hours more often and quieter ones less,
+# within the given bounds. Consecutive errors back off the interval exponentially. Polls, errors
+# and the bound on how long each change went undetected are counted for reporting.
+class PollScheduler:
+    def __init__(self, interval, mininterval, maxinterval, adaptive=False, changetimes=()):
+        self.interval    = interval
+        self.mininterval = mininterval
+        self.maxinterval = maxinterval
+        self.adaptive    = adaptive
+        self.changes     = numpy.zeros(HOURS_PER_WEEK)
+        changetimes = sorted(set(changetime.replace(minute=0, second=0, microsecond=0) for changetime in changetimes))
+        self.start = changetimes[0] if changetimes else datetime.now().replace(minute=0, second=0, microsecond=0)
+        for changetime in changetimes:
+            self.changes[self.hourOfWeek(changetime)] += 1
+
+        self.errors   = 0
+        self.lastpoll = None
+        self.resetReport(datetime.now())
+
+    def hourOfWeek(self, when):
+        return when.weekday() * 24 + when.hour
+
+    # Change rate in each hour of the week, in changes per hour
+    def rates(self, now):
+        hours = int((now - self.start).total_seconds() // 3600) + 1
+        observed = numpy.bincount((self.hourOfWeek(self.start) + numpy.arange(hours)) % HOURS_PER_WEEK, minlength=HOURS_PER_WEEK)
+        meanrate = self.changes.sum() / hours
+        rates = (self.changes + meanrate) / (observed + 1)
+        return (0.25 * numpy.roll(rates, 1) + 0.5 * rates + 0.25 * numpy.roll(rates, -1), meanrate)
+
+    # Seconds from the last poll to the next
+    def nextInterval(self, now=None):
+        now = now or datetime.now()
+        interval = self.interval
+        if self.adaptive:
+            (rates, meanrate) = self.rates(now)
+            rate = rates[self.hourOfWeek(now)]
+            if meanrate > 0:
+                interval = interval * meanrate / rate if rate > 0 else self.maxinterval
+            interval = min(self.maxinterval, max(self.mininterval, interval))
+            if self.errors:
+                # The exponent is capped so that a long outage cannot overflow the interval
+                interval = min(self.maxinterval, interval * 2 ** min(self.errors, 16))
+
+        return interval
+
+    # Record the outcome of a poll
+    def record(self, polltime, changed=False, error=False):
+        self.polls += 1
+        if error:
+            self.errors += 1
+            self.reporterrors += 1
+        else:
+            self.errors = 0
+
+        if changed:
+            self.changes[self.hourOfWeek(polltime)] += 1
+            self.reportchanges += 1
+            # The change happened at some time since the previous poll
+            if self.lastpoll is not None:
+                latency = (polltime - self.lastpoll).total_seconds()
+                self.latencies += [latency]
+
+        if not error:
+            self.lastpoll = polltime
+
+    def resetReport(self, now):
+        self.reportstart   = now
+        self.polls         = 0
+        self.reporterrors  = 0
+        self.reportchanges = 0
+        self.latencies     = []
+
+    # Return a report of polling since the last report, then start a new one
+    def report(self, now=None):
+        now = now or datetime.now()
+        hours = max((now - self.reportstart).total_seconds() / 3600, 1e-6)
+        report = "{} polls ({:.1f}/hour), {} errors, {} changes".format(self.polls, self.polls / hours, self.reporterrors, self.reportchanges)
+        if self.latencies:
+            report += ", detection latency at most {:.0f}s mean, {:.0f}s max".format(sum(self.latencies) / len(self.latencies), max(self.latencies))
+        report += ", next interval {:.0f}s".format(self.nextInterval(now))
+        self.resetReport(now)
+        return report
+
+    def reportDue(self, reportinterval, now=None):
+        return reportinterval and ((now or datetime.now()) - self.reportstart).total_seconds() >= reportinterval
+
+# Times at which burns have changed, from an archive or change log, to seed a PollScheduler
+def changeTimes(archive=None, burnslog=None):
+    changetimes = []
+    if archive:
+        changetimes += archive.changeTimes()
+    if burnslog:
+        changetimes += [dateutil.parser.parse(changetime).astimezone().replace(tzinfo=None) for changetime in burnslog.changetimes]
+    return changetimes
+
+# Poll one target for ever, writing its CSV file whenever its burns change
+async def pollTarget(target, parser, args, session, capabilities, proxypool):
+    scheduler = PollScheduler(target.interval, args.min_interval, args.max_interval, args.adaptive, changeTimes(target.archive, target.burnslog))
+    lastpolltime = None
     while True:
-
-        if args.proxy == 'free':
-            while True:
-                try:
-                    if args.verbosity >= 2:
-                        print("Looking for free proxy", file=sys.stderr)
-                    proxy = fp.get()
-                    os.environ['http_proxy']  = proxy
-                    os.environ['https_proxy'] = proxy
-                    if args.verbosity >= 2:
-                        print("Found free proxy", proxy, file=sys.stderr)
-                    break
-                except FreeProxyException as e:
-                    if args.verbosity >= 2:
-                        # print("FreeProxyException occurred", file=sys.stderr)
-                        print(e, file=sys.stderr)
-                    continue
+        if scheduler.reportDue(args.report_interval):
+            print("Polling", target.layer + ":", scheduler.report(), file=sys.stderr)
 
         if lastpolltime is not None:
-            remaininginterval = args.interval - (datetime.now() - lastpolltime).total_seconds()
+            remaininginterval = scheduler.nextInterval() - (datetime.now() - lastpolltime).total_seconds()
         else:
-            remaininginterval = args.interval   # To avoid busy polling
-
-        if args.verbosity >= 2:
-            print("Remaining interval:", remaininginterval, file=sys.stderr)
+            remaininginterval = target.interval   # To avoid busy polling
 
         if remaininginterval > 0:
-            time.sleep(remaininginterval)
+            await asyncio.sleep(remaininginterval)
 
+        proxy = await asyncio.to_thread(proxypool.get) if proxypool else None
+        lastpolltime = datetime.now()
         try:
-            wms = WebMapService(args.server, version=args.version, auth=auth)
+            outdata = await asyncio.to_thread(fetchDailyBurns, session, capabilities, target.server, target.layer, args.version, target.feedstate,
+                                              args.timeout, {'http': proxy, 'https': proxy} if proxy else None, args.geometry)
+            if proxypool:
+                proxypool.record(proxy, True, (datetime.now() - lastpolltime).total_seconds())
+            if outdata is UNCHANGED:
+                if args.verbosity >= 2:
+                    print("Daily burns unchanged:", target.layer, file=sys.stderr)
+                scheduler.record(lastpolltime)
+                continue
         except Exception as e:
-            print(e, file=sys.stderr)
-            wms = None
+            print(target.server, target.layer, e, file=sys.stderr)
+            if proxypool:
+                proxypool.record(proxy, False)
+            scheduler.record(lastpolltime, error=True)
+            continue
+
+        changed = False
+
+        if outdata is not None and len(outdata) > 1 and target.archive:
+            target.archive.record(outdata, lastpolltime)
+
+        if outdata is not None and len(outdata) > 1 and target.burnslog:
+            changes = target.burnslog.update(parser, args, outdata, lastpolltime)
+            changed = bool(changes)
+            if changes and args.verbosity >= 1:
+                print("Daily burns changed:", target.layer, len(changes), "changes logged to", target.csvfile, file=sys.stderr)
+            if changes and args.geometry_out:
+                writeGeometries(args, target.burnslog.fields, [burn for (change, burn) in changes if change != 'delete'])
+        elif outdata is not None and len(outdata) > 1:
+            outfieldnames = burnsChange(target.fields, target.infieldnames, target.indata, outdata, args.verbosity)
+            changed = outfieldnames is not None
+            if outfieldnames is not None:
+                if args.verbosity >= 1:
+                    print("Daily burns changed:", target.layer, "writing", target.csvfile, file=sys.stderr)
+                writeBurnsCSV(parser, args, target.csvfile, target.incomments, outfieldnames, outdata)
+                if args.geometry_out:
+                    writeGeometries(args, outfieldnames, outdata)
+                (target.incomments, target.infieldnames, target.indata) = readBurnsCSV(target.csvfile)
+
+        scheduler.record(lastpolltime, changed)
+
+# Poll several targets concurrently over one HTTP connection pool and one proxy pool
+async def pollTargets(targets, parser, args):
+    session = burnsSession(args, len(targets))
+    capabilities = CapabilitiesCache(session, args.capabilities_ttl)
+    proxypool = ProxyPool(targets[0].server, args.proxy_pool, args.timeout, args.verbosity) if args.proxy == 'free' else None
+    await asyncio.gather(*(pollTarget(target, parser, args, session, capabilities, proxypool) for target in targets))
 
-        lastpolltime = datetime.now()
-        if wms:
-            try:
-                outdata = decodeDailyBurns(wms)
-            except Exception as e:
-                print(e, file=sys.stderr)
-                outdata = None
+def getDailyBurns(arglist=None):
+    parser = ArgumentRecorder(description='Read Daily Burns from DBCA WMS server, stopping a change is detected.',
+                              fromfile_prefix_chars='@')
 
-            if outdata is not None and len(outdata) > 1:
-                outfieldnames = args.fields
-                outfieldnames += list(set(sum([list(item.keys()) for item in outdata], start=[])) - set(outfieldnames))
+    parser.add_argument('-v', '--verbosity',  type=int, default=1, private=True)
 
-                if set(outfieldnames) != set(infieldnames) or len(outdata) != len(indata):
-                    break
+    parser.add_argument('-s', '--server',     type=str,
+                                              default='https://kmi.dpaw.wa.gov.au/geoserver/public/wms')
+    parser.add_argument('-V', '--version',    type=str,
+                                              default='1.1.1')
+    parser.add_argument('-p', '--proxy',      type=str, help='Proxy URL or "free" to use free-proxy'),
+    parser.add_argument('--proxy-pool',       type=int, default=8, help='Number of free proxies to keep checked and ready')
+    parser.add_argument('-l', '--layer',      type=str,
+                                              default='public:todays_burns')
+    parser.add_argument('-c', '--csvfile',    type=str,
+                                              help='Output CSV file, otherwise use stdout.', output=True)
+    parser.add_argument('-i', '--interval',   type=int, default=60,
+                                              help='Polling interval.')
+    parser.add_argument('-t', '--timeout',    type=int, default=30,
+                                              help='Timeout for WMS request.')
+    parser.add_argument('-a', '--adaptive',   action='store_true',
+                                              help='Adapt the polling interval to how often burns have changed at each hour of the week, and back off on errors')
+    parser.add_argument('--min-interval',     type=int, default=15,
+                                              help='Shortest adaptive polling interval.')
+    parser.add_argument('--max-interval',     type=int, default=900,
+                                              help='Longest adaptive polling interval.')
+    parser.add_argument('--report-interval',  type=int,
+                                              help='Seconds between reports of polls, errors, changes and detection latency, default is hourly with --adaptive')
+    parser.add_argument('--capabilities-ttl', type=int, default=3600,
+                                              help='Seconds to keep WMS capabilities before fetching them again.')
+    parser.add_argument('-T', '--target',     type=str, nargs=4, action='append', metavar=('SERVER', 'LAYER', 'CSVFILE', 'INTERVAL'),
+                                              help='Poll several targets concurrently, writing each CSV file when it changes, instead of --server, --layer and --csvfile')
+    parser.add_argument('-L', '--change-log', action='store_true',
+                                              help='Keep polling, appending changes to burns to the CSV file as a change log, rather than rewriting it and exiting')
+    parser.add_argument('--compact',          type=int,
+                                              help='Rewrite the change log as a snapshot once it holds this many changes')
+    parser.add_argument('-A', '--archive',    type=str,
+                                              help='Archive file recording every version of each burn and when it was advertised, see daily_burns_archive.py')
+    parser.add_argument('-G', '--geometry',   action='store_true',
+                                              help='Keep burn geometries, as WKT in a geom field')
+    parser.add_argument('--geometry-out',     type=str,
+                                              help='GeoPackage file (.gpkg) or PostgreSQL connection string to write burn geometries to, implies --geometry')
+    parser.add_argument('--geometry-table',   type=str, default='daily_burns',
+                                              help='Table to write burn geometries to')
+    parser.add_argument('-F', '--fields',     type=str, nargs='+', help='Ordered list of fields',
+                        default=['burn_id','location','indicative_area','burn_purpose','burn_planned_area_today','burn_stat','burn_est_start','burn_target_lat','burn_target_long'])
 
-                for data in outdata:
-                    for fieldname in outfieldnames:
-                        data[fieldname] = data.get(fieldname, '')
 
-                if not all((indata[idx][fieldname] == outdata[idx][fieldname] for idx in range(len(indata)) for fieldname in outfieldnames)):
-                    if args.verbosity >= 2:
-                        print([(indata[idx][fieldname], outdata[idx][fieldname]) for idx in range(len(indata)) for fieldname in outfieldnames if indata[idx][fieldname] != outdata[idx][fieldname]], file=sys.stderr)
-                    break
+    parser.add_argument('--no-comments',      action='store_true', help='Do not output descriptive comments')
+    parser.add_argument('--no-header',        action='store_true', help='Do not output CSV header with column names')
 
-    if args.csvfile is not None:
-        if os.path.exists(args.csvfile):
-            shutil.move(args.csvfile, args.csvfile + '.bak')
+    args = parser.parse_args(arglist)
+    if args.geometry_out:
+        args.geometry = True
+    if args.report_interval is None and args.adaptive:
+        args.report_interval = 3600
+
+    csv.field_size_limit(sys.maxsize)
 
-        csvfile = open(args.csvfile, 'w')
+    if args.target:
+        targets = [BurnsTarget(server, layer, csvfile, int(interval), args.fields, args.change_log, args.compact, args.archive) for (server, layer, csvfile, interval) in args.target]
+        asyncio.run(pollTargets(targets, parser, args))
+        return
+
+    if args.change_log:
+        if not args.csvfile:
+            parser.error('--change-log requires --csvfile')
+        burnslog = BurnsLog(args.csvfile, args.fields, args.compact)
     else:
-        csvfile = sys.stdout
+        burnslog = None
+        (incomments, infieldnames, indata) = readBurnsCSV(args.csvfile)
 
-    if not args.no_comments:
-        parser.write_comments(args, csvfile, incomments=incomments)
+    archive = BurnsArchive(args.archive, args.layer) if args.archive else None
+    feedstate = FeedState()
+    session = burnsSession(args)
+    capabilities = CapabilitiesCache(session, args.capabilities_ttl)
+    proxypool = ProxyPool(args.server, args.proxy_pool, args.timeout, args.verbosity) if args.proxy == 'free' else None
 
-    csvwriter=csv.DictWriter(csvfile, fieldnames=outfieldnames)
-    csvwriter.writeheader()
-    for item in outdata:
-        csvwriter.writerow(item)
+    scheduler = PollScheduler(args.interval, args.min_interval, args.max_interval, args.adaptive, changeTimes(archive, burnslog))
+    lastpolltime = None
 
-    if args.csvfile is not None:
-        csvfile.close()
+    while True:
+
+        if scheduler.reportDue(args.report_interval):
+            print("Polling:", scheduler.report(), file=sys.stderr)
+
+        if lastpolltime is not None:
+            remaininginterval = scheduler.nextInterval() - (datetime.now() - lastpolltime).total_seconds()
+        else:
+            remaininginterval = args.interval   # To avoid busy polling
+
+        if args.verbosity >= 2:
+            print("Remaining interval:", remaininginterval, file=sys.stderr)
+
+        if remaininginterval > 0:
+            time.sleep(remaininginterval)
+
+        proxy = proxypool.get() if proxypool else None
+        if proxy and args.verbosity >= 2:
+            print("Using free proxy", proxy, file=sys.stderr)
+
+        lastpolltime = datetime.now()
+        try:
+            outdata = fetchDailyBurns(session, capabilities, args.server, args.layer, args.version, feedstate, args.timeout,
+                                      {'http': proxy, 'https': proxy} if proxy else None, args.geometry)
+            if proxypool:
+                proxypool.record(proxy, True, (datetime.now() - lastpolltime).total_seconds())
+        except Exception as e:
+            print(e, file=sys.stderr)
+            if proxypool:
+                proxypool.record(proxy, False)
+            scheduler.record(lastpolltime, error=True)
+            continue
+
+        if outdata is UNCHANGED:
+            if args.verbosity >= 2:
+                print("Daily burns unchanged", file=sys.stderr)
+            scheduler.record(lastpolltime)
+            continue
+
+        changed = False
+
+        if outdata is not None and len(outdata) > 1 and archive:
+            archive.record(outdata, lastpolltime)
+
+        if outdata is not None and len(outdata) > 1 and burnslog:
+            changes = burnslog.update(parser, args, outdata, lastpolltime)
+            changed = bool(changes)
+            if changes and args.verbosity >= 1:
+                print("Daily burns changed:", len(changes), "changes logged", file=sys.stderr)
+            if changes and args.geometry_out:
+                writeGeometries(args, burnslog.fields, [burn for (change, burn) in changes if change != 'delete'])
+        elif outdata is not None and len(outdata) > 1:
+            outfieldnames = burnsChange(args.fields, infieldnames, indata, outdata, args.verbosity)
+            if outfieldnames is not None:
+                break
+
+        scheduler.record(lastpolltime, changed)
+
+    if archive:
+        archive.close()
+
+    writeBurnsCSV(parser, args, args.csvfile, incomments, outfieldnames, outdata)
+    if args.geometry_out:
+        writeGeometries(args, outfieldnames, outdata)
 
 if __name__ == '__main__':
     getDailyBurns(None)
@@ -0,0 +1,181 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright 2026 Jonathan Schultz
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from argrecord import ArgumentHelper, ArgumentRecorder
+from datetime import date, timedelta
+from pyproj import Transformer
+import os
+import sys
+import shutil
+import csv
+import numpy
+import shapely
+
+from hotspotDB import HotspotDB
+
+# Attribute hotspots to planned burns recorded by DBCA/get_daily_burns.py.
+#
+# Burns are read from daily burn snapshot CSV files and placed in an STRtree for each day,
+# holding the burns targeted for that day or the few days before it. A burn's footprint is its
+# geometry, if the snapshot has one, or a buffer around its target location. Hotspots are then
+# streamed in time order, and each is tagged with the burn whose footprint it falls in on its
+# local date, the nearest target location winning where footprints overlap.
+
+# Australian Albers, so that distances are in metres anywhere in the state
+BURN_SRID = 3577
+
+# Read burns from snapshot CSV files, returning a dictionary of target date to lists of burn ids
+# and footprint geometries. Later snapshots of the same burn and date replace earlier ones.
+def readBurns(filenames, radius):
+    transformer = Transformer.from_crs('EPSG:4283', 'EPSG:' + str(BURN_SRID), always_xy=True)
+    csv.field_size_limit(sys.maxsize)
+
+    burns = {}
+    for filename in filenames:
+        with open(filename, 'r') as burnfile:
+            ArgumentHelper.read_comments(burnfile)
+            for row in csv.DictReader(burnfile):
+                if not row.get('burn_id') or not row.get('burn_target_date'):
+                    continue
+
+                if row.get('geom'):
+                    footprint = shapely.transform(shapely.from_wkt(row['geom']), lambda coords: numpy.column_stack(transformer.transform(coords[:,0], coords[:,1])))
+                elif row.get('burn_target_lat') and row.get('burn_target_long'):
+                    footprint = shapely.Point(transformer.transform(float(row['burn_target_long']), float(row['burn_target_lat']))).buffer(radius)
+                else:
+                    continue
+
+                burns[(row['burn_id'], date.fromisoformat(row['burn_target_date']))] = footprint
+
+    burndates = {}
+    for ((burn_id, targetdate), footprint) in burns.items():
+        (burn_ids, footprints) = burndates.setdefault(targetdate, ([], []))
+        burn_ids += [burn_id]
+        footprints += [footprint]
+
+    return burndates
+
+def attributeBurns(arglist=None):
+
+    parser = ArgumentRecorder(description='Attribute hotspots to planned burns from daily burn snapshots.',
+                              fromfile_prefix_chars='@')
+
+    parser.add_argument('-v', '--verbosity',  type=int, default=1, private=True)
+
+    parser.add_argument('-u', '--user',       type=str, help="PostgreSQL username")
+    parser.add_argument('-d', '--database',   type=str, help="PostgreSQL database")
+    parser.add_argument('-t', '--table',      type=str, required=True, help="Hotspot table")
+    parser.add_argument('-w', '--where',      type=str, default='True', help="'Where' clause to select hotspots")
+    parser.add_argument('--fetch-size',       type=int, default=10000, help='Number of hotspots to fetch from the database at a time')
+
+    parser.add_argument('-b', '--burns',      type=str, nargs='+', required=True, help='Daily burn snapshot CSV files', input=True)
+    parser.add_argument('-r', '--radius',     type=float, default=3000, help='Radius in metres around burn target location, where burn has no geometry')
+    parser.add_argument('--days',             type=int, default=2, help='Number of days after its target date that a burn may produce hotspots')
+    parser.add_argument('--utc-offset',       type=float, default=8, help='Offset in hours of local time from UTC, used to find the local date of a hotspot')
+
+    parser.add_argument('-o', '--outtable',   type=str, help="Output table, default is 'table'_burns")
+    parser.add_argument('-D', '--drop-table', action='store_true', help='Drop output table if it exists')
+
+    parser.add_argument('--logfile',          type=str, help="Logfile, default is 'outtable'.log", private=True)
+    parser.add_argument('--no-logfile',       action='store_true', help='Do not output descriptive comments')
+
+    args = parser.parse_args(arglist)
+
+    if not args.outtable:
+        args.outtable = args.table + '_burns'
+
+    if not args.no_logfile:
+        if not args.logfile:
+            args.logfile = args.outtable + '.log'
+
+        if os.path.exists(args.logfile):
+            shutil.move(args.logfile, args.logfile.split('/')[-1].rsplit('.',1)[0] + '.bak')
+
+        logfile = open(args.logfile, 'w')
+        parser.write_comments(args, logfile, incomments=ArgumentHelper.separator())
+        logfile.close()
+
+    burndates = readBurns(args.burns, args.radius)
+    transformer = Transformer.from_crs('EPSG:4326', 'EPSG:' + str(BURN_SRID), always_xy=True)
+
+    # STRtree of the burns that may be burning on a local date, built when first needed and
+    # dropped once hotspots have moved on to later dates
+    trees = {}
+    def burnTree(localdate):
+        if localdate not in trees:
+            (burn_ids, footprints) = ([], [])
+            for days in range(args.days + 1):
+                (dayburn_ids, dayfootprints) = burndates.get(localdate - timedelta(days=days), ([], []))
+                burn_ids += dayburn_ids
+                footprints += dayfootprints
+
+            trees[localdate] = (numpy.array(burn_ids, dtype=object), shapely.STRtree(footprints)) if burn_ids else None
+
+        return trees[localdate]
+
+    hotspotdb = HotspotDB(args.database, args.user)
+    if args.drop_table:
+        hotspotdb.execute('DROP TABLE IF EXISTS ' + args.outtable)
+    hotspotdb.execute('CREATE TABLE ' + args.outtable + ' AS TABLE ' + args.table + ' WITH NO DATA')
+    hotspotdb.execute('ALTER TABLE ' + args.outtable + ' ADD COLUMN burn_id TEXT')
+
+    indb = HotspotDB(args.database, args.user, args.fetch_size)
+    (fieldnames, inbatches) = indb.read('SELECT * FROM ' + args.table + ' WHERE ' + args.where + ' ORDER BY acq_datetime')
+    (acqidx, lonidx, latidx) = (fieldnames.index(fieldname) for fieldname in ('acq_datetime', 'longitude', 'latitude'))
+
+    (rowcount, burncount) = (0, 0)
+    with hotspotdb.copy(args.outtable, fieldnames + ['burn_id']) as write:
+        for inrows in inbatches:
+            (x, y) = transformer.transform(numpy.array([inrow[lonidx] for inrow in inrows], dtype=float),
+                                           numpy.array([inrow[latidx] for inrow in inrows], dtype=float))
+            points = shapely.points(x, y)
+            localdates = (numpy.array([inrow[acqidx] for inrow in inrows], dtype='datetime64[us]') + numpy.timedelta64(int(args.utc_offset * 60), 'm')).astype('datetime64[D]')
+            hotspotburns = numpy.full(len(inrows), None, dtype=object)
+
+            for localdate in numpy.unique(localdates):
+                tree = burnTree(localdate.tolist())
+                if tree is None:
+                    continue
+
+                (burn_ids, strtree) = tree
+                idxs = numpy.flatnonzero(localdates == localdate)
+                (pointidxs, burnidxs) = strtree.query(points[idxs], predicate='intersects')
+                if len(pointidxs):
+                    # Where a hotspot falls in several footprints, take the burn with the nearest centre
+                    distances = shapely.distance(points[idxs][pointidxs], shapely.centroid(strtree.geometries[burnidxs]))
+                    order = numpy.lexsort((distances, pointidxs))
+                    first = numpy.r_[True, pointidxs[order][1:] != pointidxs[order][:-1]]
+                    hotspotburns[idxs[pointidxs[order][first]]] = burn_ids[burnidxs[order][first]]
+
+            for localdate in [localdate for localdate in trees if localdate < localdates.min().tolist()]:
+                del trees[localdate]
+
+            write([list(inrow) + [burn_id] for (inrow, burn_id) in zip(inrows, hotspotburns)])
+            rowcount += len(inrows)
+            burncount += int(numpy.count_nonzero(hotspotburns != None))
+
+    hotspotdb.execute('CREATE INDEX ON ' + args.outtable + ' (burn_id)')
+
+    if args.verbosity >= 1:
+        print("Attributed", burncount, "of", rowcount, "hotspots to planned burns", file=sys.stderr)
+
+    indb.close()
+    hotspotdb.close()
+
+if __name__ == '__main__':
+    attributeBurns(None)
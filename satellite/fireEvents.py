@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright 2026 Jonathan Schultz
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from collections import deque
+from datetime import timedelta
+import math
+
+# Streaming clustering of hotspots into fire events.
+#
+# Two hotspots belong to the same event if they are within a given distance and time of each
+# other, or are linked by a chain of such hotspots. Hotspots arrive roughly in acquisition time
+# order and are held in a uniform grid of cells the size of the linking distance, so only the
+# surrounding cells need to be searched for neighbours. Events are merged with union-find, the
+# older (lower numbered) event surviving. A hotspot is released, with the event id it has at
+# that time, once it is too old to link to any hotspot yet to arrive, so memory is bounded by
+# the time window. Events that merge after some of their hotspots have been released are
+# listed by merges(), so that released event ids can be updated afterwards.
+
+KM_PER_DEGREE_LAT = 110.574
+KM_PER_DEGREE_LON = 111.320
+
+class EventClusterer:
+    # distance in km, window and lag as timedeltas. Hotspots may arrive up to lag out of order.
+    def __init__(self, distance=2.0, window=timedelta(hours=24), lag=timedelta(0), firstevent=1):
+        self.distance  = distance
+        self.window    = window
+        self.lag       = lag
+        self.nextevent = firstevent
+        self.cells     = {}
+        self.active    = deque()
+        self.parents   = {}
+        self.released  = set()
+        self.latest    = None
+
+    def find(self, event):
+        root = event
+        while root in self.parents:
+            root = self.parents[root]
+        while event != root:
+            parent = self.parents[event]
+            self.parents[event] = root
+            event = parent
+        return root
+
+    def union(self, event1, event2):
+        (root1, root2) = (self.find(event1), self.find(event2))
+        if root1 != root2:
+            self.parents[max(root1, root2)] = min(root1, root2)
+        return min(root1, root2)
+
+    def position(self, longitude, latitude):
+        return (longitude * KM_PER_DEGREE_LON * math.cos(math.radians(latitude)), latitude * KM_PER_DEGREE_LAT)
+
+    # Add a hotspot and return the event it joins. With payload None the hotspot is only used to
+    # link later hotspots, for example to continue events already stored.
+    def add(self, longitude, latitude, acqtime, payload=None, event=None):
+        (x, y) = self.position(longitude, latitude)
+        (cellx, celly) = (math.floor(x / self.distance), math.floor(y / self.distance))
+
+        if event is not None:
+            self.nextevent = max(self.nextevent, event + 1)
+            if payload is None:
+                self.released.add(event)
+
+        for neighbourx in (cellx - 1, cellx, cellx + 1):
+            for neighboury in (celly - 1, celly, celly + 1):
+                for (otherx, othery, othertime, otherevent) in self.cells.get((neighbourx, neighboury), ()):
+                    if abs(acqtime - othertime) <= self.window and math.hypot(x - otherx, y - othery) <= self.distance:
+                        event = self.find(otherevent) if event is None else self.union(event, otherevent)
+
+        if event is None:
+            event = self.nextevent
+            self.nextevent += 1
+
+        entry = (x, y, acqtime, event)
+        self.cells.setdefault((cellx, celly), []).append(entry)
+        self.active.append(((cellx, celly), entry, payload))
+        if self.latest is None or acqtime > self.latest:
+            self.latest = acqtime
+
+        return self.find(event)
+
+    # Release hotspots too old to link to any hotspot still to arrive, or all of them. Returns a
+    # list of (payload, event id) of the released hotspots that were added with a payload.
+    def release(self, everything=False):
+        released = []
+        while self.active and (everything or self.active[0][1][2] < self.latest - self.window - self.lag):
+            (cell, entry, payload) = self.active.popleft()
+            celllist = self.cells[cell]
+            celllist.remove(entry)
+            if not celllist:
+                del self.cells[cell]
+
+            event = self.find(entry[3])
+            if payload is not None:
+                released += [(payload, event)]
+                self.released.add(event)
+
+        return released
+
+    # List of (event id, surviving event id) for released or stored events that have since merged
+    def merges(self):
+        return [(event, self.find(event)) for event in self.released if self.find(event) != event]
+
+# Wrap a row writer so that each row is written, with its event id appended, once the clusterer
+# has released it. The returned function takes a list of rows, or None to release every row.
+def eventWriter(write, fieldnames, clusterer):
+    (acqidx, lonidx, latidx) = (fieldnames.index(fieldname) for fieldname in ('acq_datetime', 'longitude', 'latitude'))
+
+    def writeEvents(rows):
+        if rows is None:
+            released = clusterer.release(everything=True)
+        else:
+            for row in rows:
+                clusterer.add(float(row[lonidx]), float(row[latidx]), row[acqidx], payload=row)
+            released = clusterer.release()
+
+        if released:
+            write([list(row) + [event] for (row, event) in released])
+
+    return writeEvents
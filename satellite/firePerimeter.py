@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright 2026 Jonathan Schultz
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from argrecord import ArgumentHelper, ArgumentRecorder
+import os
+import sys
+import shutil
+import shapely
+
+from hotspotDB import HotspotDB
+
+# Build cumulative burnt area polygons from annotated hotspot envelopes, one row per
+# acquisition time. Hotspots are read in time order and the union of each pass's envelopes
+# is merged into the previous perimeter, so each step only costs the size of the current
+# perimeter rather than re-unioning every earlier footprint.
+
+PERIMETER_SRID = 28350
+
+def firePerimeter(arglist=None):
+
+    parser = ArgumentRecorder(description='Build cumulative fire perimeters from annotated hotspot envelopes.',
+                              fromfile_prefix_chars='@')
+
+    parser.add_argument('-v', '--verbosity',  type=int, default=1, private=True)
+
+    parser.add_argument('-u', '--user',       type=str, help="PostgreSQL username")
+    parser.add_argument('-d', '--database',   type=str, help="PostgreSQL database")
+    parser.add_argument('-t', '--table',      type=str, required=True, help="Annotated hotspot table with envelope column")
+    parser.add_argument('-w', '--where',      type=str, default='True', help="'Where' clause to select hotspots")
+    parser.add_argument('-E', '--by-event',   action='store_true', help='Build a separate perimeter for each fire event')
+    parser.add_argument('--fetch-size',       type=int, default=10000, help='Number of hotspots to fetch from the database at a time')
+
+    parser.add_argument('-o', '--outtable',   type=str, help="Output table, default is 'table'_perimeters")
+    parser.add_argument('-D', '--drop-table', action='store_true', help='Drop output table if it exists')
+    parser.add_argument('-I', '--incremental', action='store_true', help='Extend perimeters already in the output table with newer hotspots')
+
+    parser.add_argument('--logfile',          type=str, help="Logfile, default is 'outtable'.log", private=True)
+    parser.add_argument('--no-logfile',       action='store_true', help='Do not output descriptive comments')
+
+    args = parser.parse_args(arglist)
+
+    if not args.outtable:
+        args.outtable = args.table + '_perimeters'
+
+    if not args.no_logfile:
+        if not args.logfile:
+            args.logfile = args.outtable + '.log'
+
+        if os.path.exists(args.logfile):
+            shutil.move(args.logfile, args.logfile.split('/')[-1].rsplit('.',1)[0] + '.bak')
+
+        logfile = open(args.logfile, 'w')
+        parser.write_comments(args, logfile, incomments=ArgumentHelper.separator())
+        logfile.close()
+
+    hotspotdb = HotspotDB(args.database, args.user, args.fetch_size)
+
+    # Latest perimeter of each event, or of everything under event None
+    perimeters = {}
+    where = '(' + args.where + ') AND envelope IS NOT NULL'
+    if args.incremental and not args.drop_table and hotspotdb.tableExists(args.outtable):
+        for (event, acqtime, perimeter) in hotspotdb.fetchall('SELECT DISTINCT ON (event_id) event_id, acq_datetime, ST_AsBinary(perimeter) FROM ' + args.outtable +
+                                                              ' ORDER BY event_id, acq_datetime DESC'):
+            perimeters[event] = shapely.from_wkb(perimeter)
+
+        where += " AND acq_datetime > (SELECT COALESCE(MAX(acq_datetime), '-infinity') FROM " + args.outtable + ')'
+    else:
+        if args.drop_table:
+            hotspotdb.execute('DROP TABLE IF EXISTS ' + args.outtable)
+
+        hotspotdb.execute('CREATE TABLE ' + args.outtable + ' (                \
+                               acq_datetime TIMESTAMP WITHOUT TIME ZONE NOT NULL, \
+                               event_id INTEGER,                                  \
+                               hotspots INTEGER,                                  \
+                               area_ha DOUBLE PRECISION,                          \
+                               perimeter geometry)')
+        hotspotdb.execute('CREATE UNIQUE INDEX ON ' + args.outtable + ' (acq_datetime, event_id)')
+
+    indb = HotspotDB(args.database, args.user, args.fetch_size)
+    (fieldnames, inbatches) = indb.read('SELECT acq_datetime, ' + ('event_id' if args.by_event else 'NULL::integer') + ', envelope FROM ' + args.table +
+                                        ' WHERE ' + where + ' ORDER BY acq_datetime')
+
+    passcount = 0
+    with hotspotdb.copy(args.outtable, ['acq_datetime', 'event_id', 'hotspots', 'area_ha', 'perimeter']) as write:
+        # Union the envelopes of one acquisition time into the perimeters of their events
+        def writePass(acqtime, envelopes):
+            rows = []
+            for (event, geometries) in envelopes.items():
+                passunion = shapely.union_all(shapely.from_wkb(geometries))
+                perimeter = perimeters.get(event)
+                perimeter = passunion if perimeter is None else perimeter.union(passunion)
+                perimeters[event] = perimeter
+                rows += [[acqtime, event, len(geometries), perimeter.area / 10000, shapely.to_wkb(shapely.set_srid(perimeter, PERIMETER_SRID), include_srid=True)]]
+
+            write(rows)
+
+        passtime = None
+        envelopes = {}
+        for inrows in inbatches:
+            for (acqtime, event, envelope) in inrows:
+                if acqtime != passtime:
+                    if envelopes:
+                        writePass(passtime, envelopes)
+                        passcount += 1
+                    passtime = acqtime
+                    envelopes = {}
+
+                envelopes.setdefault(event, []).append(envelope)
+
+        if envelopes:
+            writePass(passtime, envelopes)
+            passcount += 1
+
+    if args.verbosity >= 1:
+        print("Built perimeters for", passcount, "passes", file=sys.stderr)
+
+    indb.close()
+    hotspotdb.close()
+
+if __name__ == '__main__':
+    firePerimeter(None)
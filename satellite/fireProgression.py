@@ -22,10 +22,9 @@ from qgis.gui import QgsMapCanvas, QgsLayerTreeMapCanvasBridge
 from qgis.PyQt import QtGui
 from PyQt5.QtGui import QColor, QFont
 from PyQt5.QtCore import QDate, QTime, QDateTime
-from dateutil import parser as dateparser
-import subprocess
 import sys
-import csv
+
+from hotspotDB import HotspotDB
 
 def fireProgression(arglist=None):
 
@@ -34,7 +33,11 @@ def fireProgression(arglist=None):
 
     parser.add_argument('-v', '--verbosity',  type=int, default=1, private=True)
 
+    parser.add_argument('-u', '--user',       type=str, help="PostgreSQL username")
+    parser.add_argument('-d', '--database',   type=str, help="PostgreSQL database")
     parser.add_argument('-t', '--table',      type=str, required=True, help="PostgreSQL table with hotspot datas")
+    parser.add_argument('-e', '--event',      type=int, nargs='+', help='Only render hotspots from these fire events, as assigned by trackHotspotSatellite')
+    parser.add_argument('--fetch-size',       type=int, default=1000, help='Number of rows to fetch from the database at a time')
 
     parser.add_argument('-q', '--qgisfile',   type=str, required=True, help='QGIS base file')
     parser.add_argument('-l', '--layout',     type=str, required=True, help='Layout from QGIS file')
@@ -47,7 +50,7 @@ def fireProgression(arglist=None):
     args = parser.parse_args(arglist)
 
     if not args.outfile:
-        args.outfile = args.table
+        args.outfile = args.table + (''.join('_' + str(event) for event in args.event) if args.event else '')
         
     if not args.no_logfile:
         if not args.logfile and not args.outfile:
@@ -72,25 +75,31 @@ def fireProgression(arglist=None):
     project = QgsProject.instance()
     project.read(args.qgisfile)
 
+    # Only show the hotspots of the chosen events, in every layer drawn from the hotspot table
+    if args.event:
+        eventfilter = 'event_id IN (' + ', '.join(str(event) for event in args.event) + ')'
+        for layer in project.mapLayers().values():
+            if isinstance(layer, QgsVectorLayer) and QgsDataSourceUri(layer.source()).table() == args.table.split('.')[-1]:
+                layer.setSubsetString('(' + layer.subsetString() + ') AND ' + eventfilter if layer.subsetString() else eventfilter)
+
     manager = QgsProject.instance().layoutManager()
     layout = manager.layoutByName(args.layout)
 
-    psqlin = subprocess.Popen(['psql',
-                               '--quiet',
-                               '--command', r'\timing off',
-                               '--command', r'\copy (SELECT satellite, instrument, acq_date + acq_time AS datetime FROM ' + args.table +
-                                             '       GROUP BY satellite, instrument, datetime ORDER BY datetime) TO STDOUT CSV HEADER'],
-                               stdout=subprocess.PIPE, encoding='UTF-8')
+    hotspotdb = HotspotDB(args.database, args.user, args.fetch_size)
+    (fieldnames, satbatches) = hotspotdb.read('SELECT satellite, instrument, acq_date + acq_time AS datetime FROM ' + args.table +
+                                              (' WHERE event_id IN (' + ', '.join(str(event) for event in args.event) + ')' if args.event else '') +
+                                              '       GROUP BY satellite, instrument, datetime ORDER BY datetime')
 
-    satcsv = csv.DictReader(psqlin.stdout)
-    for satline in satcsv:
-        temporal = QDateTime(dateparser.parse(satline['datetime']))
-        print ("Outputting: ", temporal.toString())
-        layout.items()[0].setTemporalRange(QgsDateTimeRange(temporal,temporal))
+    for satrows in satbatches:
+        for satline in (dict(zip(fieldnames, satrow)) for satrow in satrows):
+            temporal = QDateTime(satline['datetime'])
+            print ("Outputting: ", temporal.toString())
+            layout.items()[0].setTemporalRange(QgsDateTimeRange(temporal,temporal))
 
-        exporter = QgsLayoutExporter(layout)
-        exporter.exportToSvg(args.outfile + '_' + satline['datetime'] + '.svg', QgsLayoutExporter.SvgExportSettings())
+            exporter = QgsLayoutExporter(layout)
+            exporter.exportToSvg(args.outfile + '_' + str(satline['datetime']) + '.svg', QgsLayoutExporter.SvgExportSettings())
 
+    hotspotdb.close()
     qgs.exitQgis()
 
 if __name__ == '__main__':
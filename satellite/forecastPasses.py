@@ -0,0 +1,215 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright 2026 Jonathan Schultz
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from argrecord import ArgumentHelper, ArgumentRecorder
+from pyorbital.orbital import Orbital
+from dateutil import parser as dateparser
+from datetime import datetime, timedelta
+import os
+import sys
+import shutil
+import struct
+import multiprocessing
+import numpy
+
+from tleStore import openTLEs
+from trackHotspotSatellite import satcodes, windowPasses
+
+# Forecast of satellite passes over a regular longitude/latitude grid, stored in a memory-mapped
+# file so that the passes over any point can be read without propagating an orbit.
+#
+# Layout, all little-endian:
+#   header     magic 'PFCT', version, satellites, latitudes, longitudes, passes per cell,
+#              minimum longitude, minimum latitude, resolution in degrees, start and end
+#              in microseconds since 1970                                   (4s I I I I I d d d q q)
+#   satellites NORAD id of each satellite                                  (I)
+#   passes     array of shape (satellites, latitudes, longitudes, passes) of FORECAST_DTYPE,
+#              in time order within each cell and padded with NaT
+
+MAGIC          = b'PFCT'
+VERSION        = 1
+HEADER         = struct.Struct('<4sIIIIIdddqq')
+FORECAST_DTYPE = numpy.dtype([('datetime', '<M8[us]'), ('azimuth', '<f4'), ('elevation', '<f4'), ('bearing', '<f4')])
+
+UNIX_EPOCH = datetime(1970, 1, 1)
+
+class PassForecast:
+    def __init__(self, filename):
+        with open(filename, 'rb') as forecastfile:
+            header = forecastfile.read(HEADER.size)
+            (magic, version, satcount, self.latcount, self.loncount, self.passcount,
+             self.lonmin, self.latmin, self.resolution, start, end) = HEADER.unpack(header)
+            if magic != MAGIC or version != VERSION:
+                raise RuntimeError('Not a pass forecast: ' + filename)
+
+            norad_ids = struct.unpack('<' + str(satcount) + 'I', forecastfile.read(satcount * 4))
+
+        self.satindexes = {norad_id: satidx for (satidx, norad_id) in enumerate(norad_ids)}
+        self.start = UNIX_EPOCH + timedelta(microseconds=start)
+        self.end   = UNIX_EPOCH + timedelta(microseconds=end)
+        self.passes = numpy.memmap(filename, dtype=FORECAST_DTYPE, mode='r', offset=HEADER.size + satcount * 4,
+                                   shape=(satcount, self.latcount, self.loncount, self.passcount))
+
+    def satellites(self):
+        return list(self.satindexes.keys())
+
+    # Passes of a satellite over the grid cell containing (longitude, latitude), optionally only
+    # those after a given time, as an array of FORECAST_DTYPE
+    def lookup(self, norad_id, longitude, latitude, after=None):
+        latidx = int(round((latitude - self.latmin) / self.resolution))
+        lonidx = int(round((longitude - self.lonmin) / self.resolution))
+        if not (0 <= latidx < self.latcount and 0 <= lonidx < self.loncount):
+            raise IndexError('Location outside forecast grid: ' + str((longitude, latitude)))
+
+        passes = self.passes[self.satindexes[norad_id], latidx, lonidx]
+        passes = passes[~numpy.isnat(passes['datetime'])]
+        if after is not None:
+            passes = passes[passes['datetime'] > numpy.datetime64(after, 'us')]
+
+        return numpy.array(passes)
+
+    def close(self):
+        self.passes._mmap.close()
+
+# Each worker process builds the propagators for the forecast once
+def initForecast(args, norad_ids):
+    global forecastargs, forecastorbitals
+    forecastargs = args
+    tlestore = openTLEs(args.tlefile)
+    forecastorbitals = []
+    for norad_id in norad_ids:
+        (tledate, line1, line2) = tlestore.find(norad_id, args.start)
+        forecastorbitals += [Orbital("", line1=line1, line2=line2)]
+
+    tlestore.close()
+
+# Forecast the passes of each satellite over one tile of the grid. Returns the tile's grid
+# indexes and for each satellite an array of shape (cells, passes) of FORECAST_DTYPE.
+def forecastTile(tile):
+    (latidxs, lonidxs) = tile
+    (latgrid, longrid) = numpy.meshgrid(latidxs, lonidxs, indexing='ij')
+    longitudes = forecastargs.bounds[0] + longrid.ravel() * forecastargs.resolution
+    latitudes  = forecastargs.bounds[1] + latgrid.ravel() * forecastargs.resolution
+    start = numpy.datetime64(forecastargs.start, 'us')
+    end   = start + numpy.timedelta64(forecastargs.days, 'D')
+
+    satpasses = []
+    for orb in forecastorbitals:
+        (passtimes, azimuths, elevations, bearings) = windowPasses(orb, forecastargs.start, forecastargs.days * 24, longitudes, latitudes)
+        if passtimes is None:
+            satpasses += [numpy.empty((len(longitudes), 0), dtype=FORECAST_DTYPE)]
+            continue
+
+        passtimes = numpy.where((elevations >= forecastargs.horizon) & (passtimes >= start) & (passtimes < end), passtimes, numpy.datetime64('NaT'))
+        order = numpy.argsort(passtimes, axis=1)
+        passcount = int((~numpy.isnat(passtimes)).sum(axis=1).max())
+        rowidxs = numpy.arange(len(longitudes))[:,None]
+        passes = numpy.empty((len(longitudes), passcount), dtype=FORECAST_DTYPE)
+        for (field, values) in (('datetime', passtimes), ('azimuth', azimuths), ('elevation', elevations), ('bearing', bearings)):
+            passes[field] = values[rowidxs, order[:,:passcount]]
+
+        satpasses += [passes]
+
+    return (tile, satpasses)
+
+def forecastPasses(arglist=None):
+
+    parser = ArgumentRecorder(description='Forecast satellite passes over a grid of locations.',
+                              fromfile_prefix_chars='@')
+
+    parser.add_argument('-v', '--verbosity',  type=int, default=1, private=True)
+
+    parser.add_argument('-t', '--tlefile',    type=str, required=True, help='File containing TLE data, as text or a binary TLE store')
+    parser.add_argument('-s', '--satellite',  type=str, nargs='+', default=list(satcodes.keys()), help='Satellite names as in hotspot data, or NORAD catalog numbers')
+    parser.add_argument('--start',            type=str, help='Start date/time of forecast in any sensible format, default is now (UTC)')
+    parser.add_argument('--days',             type=int, default=7, help='Number of days to forecast')
+    parser.add_argument('--bounds',           type=float, nargs=4, default=[112.5, -35.5, 129.5, -13.5], metavar=('LONMIN', 'LATMIN', 'LONMAX', 'LATMAX'), help='Grid bounds, default is Western Australia')
+    parser.add_argument('-r', '--resolution', type=float, default=0.1, help='Grid spacing in degrees')
+    parser.add_argument('--horizon',          type=float, default=0, help='Minimum elevation of a pass in degrees')
+    parser.add_argument('--tile-size',        type=int, default=20, help='Number of grid cells along each side of a tile computed by one job')
+    parser.add_argument('-j', '--jobs',       type=int, default=1, help='Number of processes to compute the forecast in parallel')
+
+    parser.add_argument('-o', '--outfile',    type=str, required=True, help='Output forecast file', output=True)
+    parser.add_argument('--logfile',          type=str, help="Logfile, default is 'outfile'.log", private=True)
+    parser.add_argument('--no-logfile',       action='store_true', help='Do not output descriptive comments')
+
+    args = parser.parse_args(arglist)
+
+    if not args.no_logfile:
+        if not args.logfile:
+            args.logfile = args.outfile.split('/')[-1].rsplit('.',1)[0] + '.log'
+
+        if os.path.exists(args.logfile):
+            shutil.move(args.logfile, args.logfile.split('/')[-1].rsplit('.',1)[0] + '.bak')
+
+        logfile = open(args.logfile, 'w')
+        parser.write_comments(args, logfile, incomments=ArgumentHelper.separator())
+        logfile.close()
+
+    args.start = dateparser.parse(args.start) if args.start else datetime.utcnow().replace(microsecond=0)
+    norad_ids = [int(satellite) if satellite.isdigit() else satcodes[satellite] for satellite in args.satellite]
+
+    latcount = int(round((args.bounds[3] - args.bounds[1]) / args.resolution)) + 1
+    loncount = int(round((args.bounds[2] - args.bounds[0]) / args.resolution)) + 1
+    tiles = [(numpy.arange(latstart, min(latstart + args.tile_size, latcount)), numpy.arange(lonstart, min(lonstart + args.tile_size, loncount)))
+             for latstart in range(0, latcount, args.tile_size)
+             for lonstart in range(0, loncount, args.tile_size)]
+
+    if args.jobs > 1:
+        pool = multiprocessing.Pool(args.jobs, initializer=initForecast, initargs=(args, norad_ids))
+        results = pool.imap_unordered(forecastTile, tiles)
+    else:
+        initForecast(args, norad_ids)
+        results = map(forecastTile, tiles)
+
+    tileresults = []
+    for (tileidx, result) in enumerate(results):
+        tileresults += [result]
+        if args.verbosity >= 2:
+            print("Forecast", tileidx + 1, "of", len(tiles), "tiles", file=sys.stderr)
+
+    if args.jobs > 1:
+        pool.close()
+        pool.join()
+
+    passcount = max(passes.shape[1] for (tile, satpasses) in tileresults for passes in satpasses)
+
+    if os.path.exists(args.outfile):
+        shutil.move(args.outfile, args.outfile + '.bak')
+
+    start = (args.start - UNIX_EPOCH) // timedelta(microseconds=1)
+    with open(args.outfile, 'wb') as outfile:
+        outfile.write(HEADER.pack(MAGIC, VERSION, len(norad_ids), latcount, loncount, passcount,
+                                  args.bounds[0], args.bounds[1], args.resolution,
+                                  start, start + args.days * 86400 * 1000000))
+        outfile.write(struct.pack('<' + str(len(norad_ids)) + 'I', *norad_ids))
+
+    forecast = numpy.memmap(args.outfile, dtype=FORECAST_DTYPE, mode='r+', offset=HEADER.size + len(norad_ids) * 4,
+                            shape=(len(norad_ids), latcount, loncount, passcount))
+    forecast['datetime'] = numpy.datetime64('NaT')
+    for ((latidxs, lonidxs), satpasses) in tileresults:
+        for (satidx, passes) in enumerate(satpasses):
+            forecast[satidx, latidxs[0]:latidxs[-1] + 1, lonidxs[0]:lonidxs[-1] + 1, :passes.shape[1]] = passes.reshape(len(latidxs), len(lonidxs), -1)
+
+    forecast.flush()
+    del forecast
+
+    exit(0)
+
+if __name__ == '__main__':
+    forecastPasses(None)
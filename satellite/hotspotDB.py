@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright 2026 Jonathan Schultz
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import psycopg
+from psycopg.adapt import Dumper
+from psycopg.pq import Format
+from psycopg.types.numeric import NumericBinaryDumper
+from contextlib import contextmanager
+from decimal import Decimal
+
+# Database access for the satellite scripts. Rows are read through a server-side cursor in
+# binary format, so values arrive already typed, and written with binary COPY. Use one
+# connection for reading and another for writing, since a connection cannot fetch from a
+# cursor while a COPY is in progress.
+
+# Allow floats, such as computed pass azimuths, to be written to NUMERIC columns
+class FloatNumericBinaryDumper(NumericBinaryDumper):
+    def dump(self, obj):
+        if isinstance(obj, float):
+            obj = Decimal(repr(float(obj)))
+        return super().dump(obj)
+
+# Pass through the binary representation of types without a dumper, such as PostGIS geometry,
+# which a binary cursor returns as bytes, or bpchar, whose binary representation is its text.
+class PassthroughBinaryDumper(Dumper):
+    format = Format.BINARY
+
+    def dump(self, obj):
+        return obj.encode() if isinstance(obj, str) else obj
+
+class HotspotDB:
+    def __init__(self, database=None, user=None, batchsize=10000):
+        self.connection = psycopg.connect(dbname=database, user=user, autocommit=True)
+        self.batchsize = batchsize
+        self.connection.adapters.register_dumper(None, FloatNumericBinaryDumper)
+
+    # Execute a command, returning the number of rows it affected
+    def execute(self, command, params=None):
+        return self.connection.execute(command, params).rowcount
+
+    def fetchall(self, query, params=None):
+        return self.connection.execute(query, params).fetchall()
+
+    def tableExists(self, table):
+        return self.fetchall('SELECT to_regclass(%s) IS NOT NULL', (table,))[0][0]
+
+    def partitioned(self, table):
+        return self.fetchall("SELECT relkind = 'p' FROM pg_class WHERE oid = %s::regclass", (table,))[0][0]
+
+    def generatedColumns(self, table):
+        return set(row[0] for row in self.fetchall("SELECT attname FROM pg_attribute WHERE attrelid = %s::regclass AND attgenerated != ''", (table,)))
+
+    def columns(self, query):
+        with self.connection.cursor() as cursor:
+            cursor.execute('SELECT * FROM (' + query + ') AS query LIMIT 0')
+            return [column.name for column in cursor.description]
+
+    # Return the column names of a query and a generator of batches of its rows
+    def read(self, query, batchsize=None):
+        batchsize = batchsize or self.batchsize
+        self.connection.autocommit = False
+        cursor = self.connection.cursor(name='hotspotdb_read', binary=True)
+        cursor.itersize = batchsize
+        cursor.execute(query)
+
+        def batches():
+            while True:
+                rows = cursor.fetchmany(batchsize)
+                if not rows:
+                    break
+                yield rows
+
+            cursor.close()
+            self.connection.commit()
+            self.connection.autocommit = True
+
+        return ([column.name for column in cursor.description], batches())
+
+    # Binary COPY into the given columns of a table; yields a function that writes a list of rows.
+    # With binary False rows are written in text format, so that string values, such as fields
+    # read from a CSV file, are converted to the column types by the server.
+    @contextmanager
+    def copy(self, table, columns, binary=True):
+        if binary:
+            oids = dict(self.fetchall('SELECT attname, atttypid::integer FROM pg_attribute WHERE attrelid = %s::regclass AND attnum > 0 AND NOT attisdropped', (table,)))
+            for oid in set(oids.values()):
+                try:
+                    self.connection.adapters.get_dumper_by_oid(oid, Format.BINARY)
+                except psycopg.ProgrammingError:
+                    self.connection.adapters.register_dumper(None, type('PassthroughBinaryDumper' + str(oid), (PassthroughBinaryDumper,), {'oid': oid}))
+
+        with self.connection.cursor() as cursor:
+            with cursor.copy('COPY ' + table + ' (' + ', '.join(columns) + ') FROM STDIN' + (' (FORMAT BINARY)' if binary else '')) as copy:
+                if binary:
+                    copy.set_types([oids[column] for column in columns])
+
+                def write(rows):
+                    for row in rows:
+                        copy.write_row(row)
+
+                yield write
+
+    def close(self):
+        self.connection.close()
@@ -0,0 +1,182 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright 2026 Jonathan Schultz
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from argrecord import ArgumentHelper, ArgumentRecorder
+import os
+import sys
+import shutil
+import csv
+import io
+import gzip
+import zipfile
+import multiprocessing
+import psycopg
+
+from hotspotDB import HotspotDB
+
+# Bulk load FIRMS hotspot archive CSV files into the hotspots table.
+#
+# Each file is streamed in chunks, which are copied into a temporary staging table and then
+# inserted into the hotspots table, skipping hotspots already there. A unique index on
+# satellite, acquisition time and location makes loading idempotent, so overlapping archives
+# and repeated backfills can be loaded freely. Files are loaded in parallel, one per process;
+# overlapping files loaded at the same time are inserted in key order and retried on deadlock.
+
+# Same layout as hotspotRetrieve.sh, with geometry and acquisition time derived by the database
+HOTSPOTS_TABLE = 'CREATE TABLE IF NOT EXISTS {table} ( \
+                      {geometry} geometry(Point,4326) GENERATED ALWAYS AS (ST_SetSRID(ST_MakePoint(longitude, latitude), 4326)) STORED, \
+                      latitude float, longitude float, brightness float, scan float, track float, satellite text, instrument text, \
+                      confidence text, version text, bright_ti4 float, bright_ti5 float, bright_t31 float, frp float, daynight char, \
+                      type integer, acq_date text, acq_time text, \
+                      acq_datetime timestamp without time zone GENERATED ALWAYS AS (make_timestamp(substring(acq_date,1,4)::integer, substring(acq_date,6,2)::integer, substring(acq_date,9,2)::integer, acq_time::integer/100, acq_time::integer%100, 0)) STORED )'
+
+# Open the CSV files in an archive file, which may be plain, gzipped or a zip file of CSV files
+def openArchive(filename):
+    if filename.endswith('.zip'):
+        with zipfile.ZipFile(filename) as archive:
+            for member in archive.namelist():
+                if member.lower().endswith('.csv'):
+                    with archive.open(member) as csvfile:
+                        yield io.TextIOWrapper(csvfile, encoding='utf-8', newline='')
+    elif filename.endswith('.gz'):
+        with gzip.open(filename, 'rt', encoding='utf-8', newline='') as csvfile:
+            yield csvfile
+    else:
+        with open(filename, 'r', encoding='utf-8', newline='') as csvfile:
+            yield csvfile
+
+DEADLOCK_RETRIES = 5
+
+def initLoad(args, columns):
+    global loadargs, loadcolumns
+    loadargs = args
+    loadcolumns = columns
+
+# Load one archive file, returning the numbers of rows read, and of hotspots inserted
+def loadFile(filename):
+    hotspotdb = HotspotDB(loadargs.database, loadargs.user)
+    hotspotdb.execute('CREATE TEMPORARY TABLE staging AS SELECT ' + ', '.join(loadcolumns) + ' FROM ' + loadargs.table + ' WITH NO DATA')
+
+    (rowcount, insertcount) = (0, 0)
+    for csvfile in openArchive(filename):
+        reader = csv.reader(csvfile)
+        header = [fieldname.strip().lower() for fieldname in next(reader, [])]
+        columns = [column for column in loadcolumns if column in header]
+        idxs = [header.index(column) for column in columns]
+        # A hotspot is identified by satellite, acquisition date and time, and location
+        keyidxs = [header.index(column) for column in ('satellite', 'acq_date', 'acq_time', 'latitude', 'longitude')]
+
+        while True:
+            seen = set()
+            chunk = []
+            for row in reader:
+                rowcount += 1
+                key = tuple(row[idx] for idx in keyidxs)
+                key = key[0:2] + (int(key[2]), float(key[3]), float(key[4]))
+                if key not in seen:
+                    seen.add(key)
+                    chunk += [[row[idx] if row[idx] != '' else None for idx in idxs]]
+                    if len(chunk) >= loadargs.chunk_size:
+                        break
+
+            if not chunk:
+                break
+
+            with hotspotdb.copy('staging', columns, binary=False) as write:
+                write(chunk)
+
+            # Insert in key order, so that workers loading overlapping files take their locks on
+            # the unique index in the same order, and retry the rare deadlock that remains
+            for attempt in range(DEADLOCK_RETRIES):
+                try:
+                    insertcount += hotspotdb.execute('INSERT INTO ' + loadargs.table + ' (' + ', '.join(columns) + ')' +
+                                                     ' SELECT ' + ', '.join(columns) + ' FROM staging' +
+                                                     ' ORDER BY satellite, acq_date, acq_time::integer, latitude, longitude ON CONFLICT DO NOTHING')
+                    break
+                except psycopg.errors.DeadlockDetected:
+                    if attempt == DEADLOCK_RETRIES - 1:
+                        raise
+            hotspotdb.execute('TRUNCATE staging')
+
+    hotspotdb.close()
+
+    return (filename, rowcount, insertcount)
+
+def hotspotLoad(arglist=None):
+
+    parser = ArgumentRecorder(description='Bulk load FIRMS hotspot archive files into a hotspot table.',
+                              fromfile_prefix_chars='@')
+
+    parser.add_argument('-v', '--verbosity',  type=int, default=1, private=True)
+
+    parser.add_argument('-u', '--user',       type=str, help="PostgreSQL username")
+    parser.add_argument('-d', '--database',   type=str, help="PostgreSQL database")
+    parser.add_argument('-t', '--table',      type=str, default='hotspots', help="Hotspot table name")
+    parser.add_argument('-g', '--geometry',   type=str, default='geom', help='Name of column to hold geometry data, if table is created')
+
+    parser.add_argument('-j', '--jobs',       type=int, default=1, help='Number of files to load in parallel')
+    parser.add_argument('--chunk-size',       type=int, default=100000, help='Number of rows to load at a time')
+
+    parser.add_argument('infile',             type=str, nargs='+', help='FIRMS archive CSV files, optionally gzipped or zipped', input=True)
+
+    parser.add_argument('--logfile',          type=str, help="Logfile, default is 'table'_load.log", private=True)
+    parser.add_argument('--no-logfile',       action='store_true', help='Do not output descriptive comments')
+
+    args = parser.parse_args(arglist)
+
+    if not args.no_logfile:
+        if not args.logfile:
+            args.logfile = args.table + '_load.log'
+
+        if os.path.exists(args.logfile):
+            shutil.move(args.logfile, args.logfile.split('/')[-1].rsplit('.',1)[0] + '.bak')
+
+        logfile = open(args.logfile, 'w')
+        parser.write_comments(args, logfile, incomments=ArgumentHelper.separator())
+        logfile.close()
+
+    hotspotdb = HotspotDB(args.database, args.user)
+    hotspotdb.execute(HOTSPOTS_TABLE.format(table=args.table, geometry=args.geometry))
+    hotspotdb.execute('CREATE UNIQUE INDEX IF NOT EXISTS ' + args.table + '_unique ON ' + args.table + ' (satellite, acq_datetime, latitude, longitude)')
+    generated = hotspotdb.generatedColumns(args.table)
+    columns = [column for column in hotspotdb.columns('SELECT * FROM ' + args.table) if column not in generated]
+    hotspotdb.close()
+
+    if args.jobs > 1:
+        pool = multiprocessing.Pool(args.jobs, initializer=initLoad, initargs=(args, columns))
+        results = pool.imap_unordered(loadFile, args.infile)
+    else:
+        initLoad(args, columns)
+        results = map(loadFile, args.infile)
+
+    (totalrows, totalinserts) = (0, 0)
+    for (filename, rowcount, insertcount) in results:
+        totalrows += rowcount
+        totalinserts += insertcount
+        if args.verbosity >= 1:
+            print("Loaded", filename + ":", rowcount, "rows,", insertcount, "new hotspots", file=sys.stderr)
+
+    if args.jobs > 1:
+        pool.close()
+        pool.join()
+
+    if args.verbosity >= 1:
+        print("Total:", totalrows, "rows,", totalinserts, "new hotspots", file=sys.stderr)
+
+if __name__ == '__main__':
+    hotspotLoad(None)
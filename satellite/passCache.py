@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright 2026 Jonathan Schultz
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from datetime import datetime, timedelta
+from collections import OrderedDict
+import sqlite3
+import time
+import numpy
+
+# Persistent cache of satellite pass times, stored in SQLite.
+#
+# Entries are keyed by NORAD id, TLE epoch, lat/lon grid cell and UTC date, and hold the
+# max-elevation times of every pass over the centre of the cell from the day before the
+# date to the day after it, so that any hotspot on that date can find its passes 24 hours
+# either side. The least recently used entries are evicted once the cache exceeds its size.
+#
+# The cache may be shared by several processes, so new entries are written in short bursts of
+# at most FLUSH_SIZE entries or FLUSH_SECONDS apart rather than holding a write transaction open.
+# If the database stays locked, lookups fall back to computing the passes and new entries are
+# kept until a later burst succeeds.
+
+UNIX_EPOCH = datetime(1970, 1, 1)
+FLUSH_SIZE    = 100
+FLUSH_SECONDS = 5
+LOCK_TIMEOUT  = 10
+
+class PassCache:
+    def __init__(self, filename, maxsize=1000000, resolution=0.01, memsize=10000):
+        self.maxsize    = maxsize
+        self.resolution = resolution
+        self.memsize    = memsize
+        self.memcache   = OrderedDict()
+        self.pending    = {}
+        self.flushtime  = time.time()
+        self.used       = {}
+        self.hits       = 0
+        self.misses     = 0
+        self.evictions  = 0
+        self.busy       = 0
+
+        self.db = sqlite3.connect(filename, timeout=LOCK_TIMEOUT)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('CREATE TABLE IF NOT EXISTS passes ( \
+                             norad_id INTEGER, epoch REAL, latcell INTEGER, loncell INTEGER, date TEXT, \
+                             passtimes BLOB, lastused REAL, \
+                             PRIMARY KEY (norad_id, epoch, latcell, loncell, date) )')
+        self.db.execute('CREATE INDEX IF NOT EXISTS passes_lastused ON passes (lastused)')
+
+    def cell(self, longitude, latitude):
+        return (round(latitude / self.resolution), round(longitude / self.resolution))
+
+    # Return max-elevation times of passes over the cell containing (longitude, latitude) within
+    # 24 hours of thisdatetime. compute(start, hours, longitude, latitude) is called on a miss.
+    def get(self, norad_id, epoch, longitude, latitude, thisdatetime, compute):
+        (latcell, loncell) = self.cell(longitude, latitude)
+        date = thisdatetime.date()
+        key = (norad_id, (epoch - UNIX_EPOCH).total_seconds(), latcell, loncell, date.isoformat())
+
+        passtimes = self.memcache.get(key)
+        if passtimes is not None:
+            self.memcache.move_to_end(key)
+            self.hits += 1
+        elif key in self.pending:
+            passtimes = self.pending[key]
+            self.hits += 1
+        else:
+            try:
+                row = self.db.execute('SELECT passtimes FROM passes WHERE norad_id=? AND epoch=? AND latcell=? AND loncell=? AND date=?', key).fetchone()
+            except sqlite3.OperationalError:
+                self.busy += 1
+                row = None
+
+            if row:
+                passtimes = numpy.frombuffer(row[0], dtype='datetime64[us]')
+                self.hits += 1
+            else:
+                start = datetime.combine(date, datetime.min.time()) - timedelta(hours=24)
+                passtimes = numpy.array(compute(start, 72, loncell * self.resolution, latcell * self.resolution), dtype='datetime64[us]')
+                self.pending[key] = passtimes
+                self.misses += 1
+                if len(self.pending) >= FLUSH_SIZE or time.time() - self.flushtime >= FLUSH_SECONDS:
+                    self.flush()
+
+            self.memcache[key] = passtimes
+            if len(self.memcache) > self.memsize:
+                self.memcache.popitem(last=False)
+
+        self.used[key] = time.time()
+
+        thistime = numpy.datetime64(thisdatetime, 'us')
+        window = numpy.timedelta64(24, 'h')
+        return passtimes[(passtimes >= thistime - window) & (passtimes <= thistime + window)].tolist()
+
+    # Write pending entries in one short transaction, keeping them for later if the database is locked
+    def flush(self):
+        self.flushtime = time.time()
+        if not self.pending:
+            return
+
+        try:
+            with self.db:
+                self.db.executemany('INSERT OR REPLACE INTO passes VALUES (?, ?, ?, ?, ?, ?, ?)',
+                                    (key + (passtimes.tobytes(), self.flushtime) for key, passtimes in self.pending.items()))
+            self.pending = {}
+        except sqlite3.OperationalError:
+            self.busy += 1
+
+    def close(self):
+        self.flush()
+        try:
+            with self.db:
+                self.db.executemany('UPDATE passes SET lastused=? WHERE norad_id=? AND epoch=? AND latcell=? AND loncell=? AND date=?',
+                                    ((lastused,) + key for key, lastused in self.used.items()))
+                count = self.db.execute('SELECT COUNT(*) FROM passes').fetchone()[0]
+                if count > self.maxsize:
+                    self.evictions = count - self.maxsize
+                    self.db.execute('DELETE FROM passes WHERE rowid IN (SELECT rowid FROM passes ORDER BY lastused LIMIT ?)', (self.evictions,))
+        except sqlite3.OperationalError:
+            self.busy += 1
+
+        self.db.close()
+
+    def stats(self):
+        return f"pass cache: {self.hits} hits, {self.misses} misses, {self.evictions} evictions, {self.busy} times locked"
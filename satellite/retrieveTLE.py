@@ -22,8 +22,11 @@ from spacetrack import SpaceTrackClient
 import spacetrack.operators as op
 from dateutil import parser as dateparser
 from datetime import date, timedelta
+from concurrent.futures import ThreadPoolExecutor
 import sys, os, shutil
 
+from tleStore import tleEpoch, readTLEArchive, isTLEStore, TLEStore, packTLEs
+
 def retrieveTLE(arglist=None):
 
     parser = ArgumentRecorder(description='Retrieve TLD data from space-track.org',
@@ -37,27 +40,39 @@ def retrieveTLE(arglist=None):
     parser.add_argument('-u', '--user',       type=str, required=True, help='SpaceTrack.org username')
     parser.add_argument('-p', '--password',   type=str, required=True, help='SpaceTrack.org password')
 
-    parser.add_argument('-s', '--satellite',  type=str, required=True, help='NORAD name')
-    parser.add_argument('--startdate',        type=str, required=True, help='Start date/time in any sensible format')
+    parser.add_argument('--base-url',         type=str, default='https://www.space-track.org/', help='SpaceTrack API base URL')
+
+    parser.add_argument('-s', '--satellite',  type=str, nargs='+', required=True, help='NORAD names or catalog numbers')
+    parser.add_argument('-I', '--incremental', action='store_true', help='Only retrieve TLEs newer than those already in outfile and merge them in')
+    parser.add_argument('--startdate',        type=str, help='Start date/time in any sensible format; required unless incremental')
     parser.add_argument('--enddate',          type=str, help='End date/time in any sensible format')
     parser.add_argument('-l', '--limit',      type=int, help='Limit number of TLEs to retrieve')
     
     parser.add_argument('-o', '--outfile',    type=str, help='Output CSV file, otherwise use stdout.', output=True)
+    parser.add_argument('-b', '--binary',     action='store_true', help='Write an indexed binary TLE store rather than text')
     parser.add_argument('--logfile',          type=str, help="Logfile, default is 'outfile'.log or stdout if outfile not specified")
     parser.add_argument('--no-logfile',       action='store_true', help='Do not output descriptive comments')
 
     args = parser.parse_args(arglist)
 
+    if args.incremental and not args.outfile:
+        parser.error('--incremental requires --outfile')
+    if args.binary and not args.outfile:
+        parser.error('--binary requires --outfile')
+    if not args.incremental and not args.startdate:
+        parser.error('--startdate is required unless --incremental')
+
     args.startdate = dateparser.parse(args.startdate) if args.startdate else None
     args.enddate   = dateparser.parse(args.enddate) if args.enddate else None
 
-    if args.outfile is None:
-        outfile = sys.stdout
-    else:
-        if os.path.exists(args.outfile):
-            shutil.move(args.outfile, args.outfile + '.bak')
-
-        outfile = open(args.outfile, 'w')
+    archive = {}
+    if args.incremental and os.path.exists(args.outfile):
+        if isTLEStore(args.outfile):
+            tlestore = TLEStore(args.outfile)
+            archive = tlestore.archive()
+            tlestore.close()
+        else:
+            archive = readTLEArchive(args.outfile)
 
     if not args.no_logfile:
         if not args.logfile and not args.outfile:
@@ -75,15 +90,50 @@ def retrieveTLE(arglist=None):
         if args.logfile or args.outfile:
             logfile.close()
 
-    st = SpaceTrackClient(identity=args.user, password=args.password)
+    st = SpaceTrackClient(identity=args.user, password=args.password, base_url=args.base_url)
     tledict = tlefile.read_platform_numbers()
-    norad_cat_id = tledict[args.satellite]
-    drange = op.inclusive_range(args.startdate, args.enddate or date.today())
-    lines = st.tle(norad_cat_id=norad_cat_id, epoch=drange, format='tle', limit=args.limit).split("\n")
-    for line in lines:
-        if len(line):
-            outfile.write(line + "\n")
-        
+    norad_cat_ids = [int(satellite) if satellite.isdigit() else int(tledict[satellite]) for satellite in args.satellite]
+
+    # Only ask for TLEs after the latest epoch already held for each satellite
+    def retrieve(norad_cat_id):
+        held = archive.get(norad_cat_id)
+        if held:
+            latest = max(tleEpoch(line1) for (line1, line2) in held.values())
+            epoch = op.inclusive_range(latest, args.enddate) if args.enddate else op.greater_than(latest)
+        elif args.startdate:
+            epoch = op.inclusive_range(args.startdate, args.enddate or date.today())
+        else:
+            raise RuntimeError('No TLEs held for satellite ' + str(norad_cat_id) + ' and no start date specified')
+
+        return st.gp_history(norad_cat_id=norad_cat_id, epoch=epoch, orderby='epoch', format='tle', **({'limit': args.limit} if args.limit else {})).split("\n")
+
+    with ThreadPoolExecutor(max_workers=len(norad_cat_ids)) as executor:
+        for (norad_cat_id, lines) in zip(norad_cat_ids, executor.map(retrieve, norad_cat_ids)):
+            lines = [line.rstrip() for line in lines if len(line.strip())]
+            held = archive.setdefault(norad_cat_id, {})
+            heldcount = len(held)
+            for (line1, line2) in zip(lines[0::2], lines[1::2]):
+                held[line1[18:32]] = (line1, line2)
+
+            if args.verbosity >= 1:
+                print("Satellite", norad_cat_id, "retrieved", len(lines) // 2, "TLEs,", len(held) - heldcount, "new", file=sys.stderr)
+
+    if args.outfile is None:
+        outfile = sys.stdout
+    else:
+        if os.path.exists(args.outfile):
+            shutil.move(args.outfile, args.outfile + '.bak')
+
+        outfile = open(args.outfile, 'wb' if args.binary else 'w')
+
+    # Write each satellite's TLEs in epoch order, as trackHotspotSatellite expects
+    if args.binary:
+        (outfile.buffer if args.outfile is None else outfile).write(packTLEs(archive))
+    else:
+        for norad_cat_id in sorted(archive.keys()):
+            for (line1, line2) in sorted(archive[norad_cat_id].values(), key=lambda tle: tleEpoch(tle[0])):
+                outfile.write(line1 + "\n" + line2 + "\n")
+
     if args.outfile is not None:
         outfile.close()
 
@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright 2026 Jonathan Schultz
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from datetime import datetime, timedelta
+from bisect import bisect_right
+import struct
+import mmap
+
+# Indexed binary store of TLEs, read through a memory map so that opening it costs nothing
+# however many TLEs it holds.
+#
+# Layout, all little-endian:
+#   header     magic 'TLES', version, number of satellites, reserved        (4s I I I)
+#   directory  per satellite: NORAD id, TLE count, index of first TLE       (I I Q)
+#   epochs     per TLE: epoch in seconds since 1970, in order within each satellite (d)
+#   lines      per TLE: line 1 and line 2, each padded to 69 characters
+#
+# A plain text TLE file can be read into the same structure with readTLEArchive and packTLEs.
+
+MAGIC      = b'TLES'
+VERSION    = 1
+HEADER     = struct.Struct('<4sIII')
+ENTRY      = struct.Struct('<IIQ')
+LINELENGTH = 69
+
+UNIX_EPOCH = datetime(1970, 1, 1)
+
+# TLE epoch from the first line of a TLE
+def tleEpoch(line1):
+    year2d = int(line1[18:20])
+    daynum = float(line1[20:32])
+    return datetime(2000 + year2d if year2d <= 56 else 1900 + year2d, 1, 1) + timedelta(days=daynum - 1)
+
+# Read a TLE text file into a dictionary of NORAD id to a dictionary of epoch to TLE line pair
+def readTLEArchive(tlefilename):
+    archive = {}
+    with open(tlefilename, 'r') as tlefile:
+        lines = [line.rstrip() for line in tlefile if len(line.strip())]
+
+    for (line1, line2) in zip(lines[0::2], lines[1::2]):
+        archive.setdefault(int(line1[2:7]), {})[line1[18:32]] = (line1, line2)
+
+    return archive
+
+# Pack a TLE archive as returned by readTLEArchive into the binary store layout
+def packTLEs(archive):
+    norad_ids = sorted(archive.keys())
+    tlelists = [sorted(archive[norad_id].values(), key=lambda tle: tleEpoch(tle[0])) for norad_id in norad_ids]
+
+    directory = b''
+    first = 0
+    for (norad_id, tles) in zip(norad_ids, tlelists):
+        directory += ENTRY.pack(norad_id, len(tles), first)
+        first += len(tles)
+
+    tles = [tle for tlelist in tlelists for tle in tlelist]
+    epochs = struct.pack('<' + str(len(tles)) + 'd', *((tleEpoch(line1) - UNIX_EPOCH).total_seconds() for (line1, line2) in tles))
+    lines = b''.join(line1.ljust(LINELENGTH)[:LINELENGTH].encode() + line2.ljust(LINELENGTH)[:LINELENGTH].encode() for (line1, line2) in tles)
+
+    return HEADER.pack(MAGIC, VERSION, len(norad_ids), 0) + directory + epochs + lines
+
+def writeTLEStore(filename, archive):
+    with open(filename, 'wb') as storefile:
+        storefile.write(packTLEs(archive))
+
+def isTLEStore(filename):
+    with open(filename, 'rb') as storefile:
+        return storefile.read(len(MAGIC)) == MAGIC
+
+class TLEStore:
+    # Open a store file, or wrap a buffer holding one
+    def __init__(self, filename=None, buffer=None):
+        self.mmap = None
+        if buffer is None:
+            with open(filename, 'rb') as storefile:
+                self.mmap = mmap.mmap(storefile.fileno(), 0, access=mmap.ACCESS_READ)
+            buffer = self.mmap
+
+        self.buffer = memoryview(buffer)
+        (magic, version, satcount, reserved) = HEADER.unpack_from(self.buffer, 0)
+        if magic != MAGIC or version != VERSION:
+            raise RuntimeError('Not a TLE store: ' + str(filename))
+
+        self.directory = {}
+        for satidx in range(satcount):
+            (norad_id, count, first) = ENTRY.unpack_from(self.buffer, HEADER.size + satidx * ENTRY.size)
+            self.directory[norad_id] = (count, first)
+
+        self.count = sum(count for (count, first) in self.directory.values())
+        self.epochsoffset = HEADER.size + satcount * ENTRY.size
+        self.linesoffset  = self.epochsoffset + self.count * 8
+
+    def satellites(self):
+        return sorted(self.directory.keys())
+
+    def __len__(self):
+        return self.count
+
+    # Epochs of a satellite's TLEs in seconds since 1970, as a sequence that bisect can search
+    def epochs(self, norad_id):
+        (count, first) = self.directory.get(norad_id, (0, 0))
+        start = self.epochsoffset + first * 8
+        return self.buffer[start:start + count * 8].cast('d')
+
+    # Return (epoch, line1, line2) of a satellite's TLE by its position in epoch order
+    def tle(self, norad_id, index):
+        (count, first) = self.directory[norad_id]
+        start = self.linesoffset + (first + index) * LINELENGTH * 2
+        line1 = bytes(self.buffer[start:start + LINELENGTH]).decode().rstrip()
+        line2 = bytes(self.buffer[start + LINELENGTH:start + LINELENGTH * 2]).decode().rstrip()
+        return (tleEpoch(line1), line1, line2)
+
+    def tles(self, norad_id):
+        return [self.tle(norad_id, index) for index in range(self.directory.get(norad_id, (0, 0))[0])]
+
+    # Return the latest TLE with epoch no later than thisdatetime, or the earliest if there is none
+    def find(self, norad_id, thisdatetime):
+        index = bisect_right(self.epochs(norad_id), (thisdatetime - UNIX_EPOCH).total_seconds())
+        return self.tle(norad_id, max(index - 1, 0))
+
+    # Archive dictionary as returned by readTLEArchive, for merging
+    def archive(self):
+        return {norad_id: {line1[18:32]: (line1, line2) for (epoch, line1, line2) in self.tles(norad_id)} for norad_id in self.satellites()}
+
+    def close(self):
+        self.buffer.release()
+        if self.mmap is not None:
+            self.mmap.close()
+
+# Open a TLE file in either binary store or text format
+def openTLEs(filename):
+    if isTLEStore(filename):
+        return TLEStore(filename)
+    else:
+        return TLEStore(buffer=packTLEs(readTLEArchive(filename)))
@@ -21,139 +21,277 @@ from spacetrack import SpaceTrackClient
 from pyorbital.orbital import Orbital
 from pyorbital import tlefile
 import spacetrack.operators as op
-from dateutil import parser as dateparser
-from datetime import datetime, timedelta, MINYEAR
+from datetime import date, datetime, timedelta, MINYEAR
 import math
 import os
 import sys
 import shutil
-import csv
 #from geo import sphere
 import geosphere
-import subprocess
+import multiprocessing
+import numpy
+import struct
+from collections import OrderedDict
+from pyproj import Transformer
 
-def trackHotspotSatellite(arglist=None):
+from passCache import PassCache
+from tleStore import openTLEs
+from hotspotDB import HotspotDB
+from fireEvents import EventClusterer, eventWriter
 
-    parser = ArgumentRecorder(description='Track satellite position, bearing, previous and next passdatetimes from hotspot data.',
-                              fromfile_prefix_chars='@')
+# WGS84 ellipsoid, kilometres
+EARTH_A = 6378.137
+EARTH_F = 1 / 298.257223563
 
-    parser.add_argument('-v', '--verbosity',  type=int, default=1, private=True)
+def geodetic2ecef(lon, lat, alt):
+    lon = numpy.radians(lon)
+    lat = numpy.radians(lat)
+    e2 = EARTH_F * (2 - EARTH_F)
+    n = EARTH_A / numpy.sqrt(1 - e2 * numpy.sin(lat) ** 2)
+    return numpy.stack(((n + alt) * numpy.cos(lat) * numpy.cos(lon),
+                        (n + alt) * numpy.cos(lat) * numpy.sin(lon),
+                        (n * (1 - e2) + alt) * numpy.sin(lat)), axis=-1)
 
-    parser.add_argument('-u', '--user',       type=str, required=True, help="PostgreSQL username")
-    parser.add_argument('-d', '--database',   type=str, required=True, help="PostgreSQL database")
+# Vectorised version of geosphere.distance_bearing(lat1, lon1, lat2, lon2)[1]
+def sphereBearing(lat1, lon1, lat2, lon2):
+    lat1 = numpy.radians(lat1)
+    lat2 = numpy.radians(lat2)
+    londiff = numpy.radians(lon2 - lon1)
+    bearing = numpy.arctan2(numpy.sin(londiff) * numpy.cos(lat2),
+                            numpy.cos(lat1) * numpy.sin(lat2) - numpy.sin(lat1) * numpy.cos(lat2) * numpy.cos(londiff))
+    return numpy.degrees(bearing) % 360
 
-    parser.add_argument('-l', '--limit',      type=int, help='Limit number of rows to process')
-    
-    parser.add_argument('-t', '--tlefile',    type=str, required=True, help='File containing TLE data')
-    parser.add_argument('-w', '--where',      type=str, default='True', help="'Where' clause to select hotspots")
-    parser.add_argument('-H', '--hotspots',   type=str, default='hotspots', help="Hotspot table name")
-    parser.add_argument('-s', '--suffix',     type=str, required=True, help="Suffix to append to 'hotspots' to get output table name")
-    parser.add_argument('-D', '--drop-table', action='store_true', help='Drop output table if it exists')
-    
-    parser.add_argument('--logfile',          type=str, help="Logfile, default is 'hotspots'_'suffix'.log", private=True)
-    parser.add_argument('--no-logfile',       action='store_true', help='Do not output descriptive comments')
+# Find the passes of a satellite over a set of nearby locations in a window of time. Candidate
+# passes are found once for the centre of the locations, with the horizon lowered so that passes
+# only visible from the edge are not missed. The ground track around each candidate pass is then
+# sampled coarsely to bracket the elevation peak at each location, and the peak is refined by a
+# golden-section search on the same elevation that get_next_passes maximises, to the same 1 ms
+# tolerance, so the results match those of get_next_passes for each location.
+#
+# Returns arrays of shape (locations, passes) of pass times, azimuths, elevations and bearings.
+SWATH_HORIZON = -15
+SWATH_WINDOW  = 600
+SWATH_STEP    = 10
+SWATH_TOL     = 0.001
+GOLDEN_RATIO  = (math.sqrt(5) - 1) / 2
+def windowPasses(orb, start, hours, longitudes, latitudes):
+    candidates = [next_pass[2] for next_pass in orb.get_next_passes(start, hours, float(numpy.mean(longitudes)), float(numpy.mean(latitudes)), 0, horizon=SWATH_HORIZON)]
+    if not candidates:
+        return (None, None, None, None)
 
-    args = parser.parse_args(arglist)
+    # Local vertical at each location is the normal to the ellipsoid, not the geocentric radial
+    observers = geodetic2ecef(longitudes, latitudes, 0)
+    (lonradians, latradians) = (numpy.radians(longitudes), numpy.radians(latitudes))
+    zeniths = numpy.stack((numpy.cos(latradians) * numpy.cos(lonradians),
+                           numpy.cos(latradians) * numpy.sin(lonradians),
+                           numpy.sin(latradians)), axis=-1)
+    steps = numpy.arange(-SWATH_WINDOW, SWATH_WINDOW + SWATH_STEP, SWATH_STEP)
+    zeros = numpy.zeros(len(longitudes))
+    passtimes = numpy.empty((len(longitudes), len(candidates)), dtype='datetime64[us]')
+    for passidx, candidate in enumerate(candidates):
+        sampletimes = numpy.datetime64(candidate, 'us') + steps * numpy.timedelta64(1, 's')
+        (lon, lat, alt) = orb.get_lonlatalt(sampletimes)
+        satellites = geodetic2ecef(lon, lat, alt)
+        lookvectors = satellites[None,:,:] - observers[:,None,:]
+        sinelevations = numpy.einsum('ijk,ik->ij', lookvectors, zeniths) / numpy.linalg.norm(lookvectors, axis=-1)
 
-    if not args.no_logfile:
-        if not args.logfile:
-            args.logfile = args.hotspots + '_' + args.suffix + '.log'
+        # Golden-section search for the peak within one sample either side of the highest sample
+        peakidxs = numpy.clip(numpy.argmax(sinelevations, axis=1), 1, len(steps) - 2)
+        basetimes = sampletimes[peakidxs]
+        def elevation(offsets):
+            return orb.get_observer_look(basetimes + numpy.round(offsets * 1e6).astype('timedelta64[us]'), longitudes, latitudes, zeros)[1]
 
-        if os.path.exists(args.logfile):
-            shutil.move(args.logfile, args.logfile.split('/')[-1].rsplit('.',1)[0] + '.bak')
-            
-        logfile = open(args.logfile, 'w')
-        parser.write_comments(args, logfile, incomments=ArgumentHelper.separator())
-        logfile.close()
+        (lower, upper) = (numpy.full(len(longitudes), -float(SWATH_STEP)), numpy.full(len(longitudes), float(SWATH_STEP)))
+        (inner1, inner2) = (upper - GOLDEN_RATIO * (upper - lower), lower + GOLDEN_RATIO * (upper - lower))
+        (elevation1, elevation2) = (elevation(inner1), elevation(inner2))
+        while (upper[0] - lower[0]) > SWATH_TOL:
+            rising = elevation1 < elevation2
+            lower = numpy.where(rising, inner1, lower)
+            upper = numpy.where(rising, upper, inner2)
+            (inner1, inner2) = (numpy.where(rising, inner2, upper - GOLDEN_RATIO * (upper - lower)),
+                                numpy.where(rising, lower + GOLDEN_RATIO * (upper - lower), inner1))
+            newelevations = elevation(numpy.where(rising, inner2, inner1))
+            (elevation1, elevation2) = (numpy.where(rising, elevation2, newelevations), numpy.where(rising, newelevations, elevation1))
 
-    satcodes = { 'N':     37849,
-                'Terra': 25994,
-                'Aqua':  27424 }
-
-    tledict = {}
-    for norad_id in satcodes.values():
-        tledict[norad_id] = ()
-
-    tlefile = open(args.tlefile, 'r')
-    line1 = tlefile.readline().rstrip()
-    while len(line1) > 1:
-        norad_id = int(line1[2:7])
-        year2d = int(line1[18:20])
-        daynum = float(line1[20:32])
-        tledate = datetime(2000 + year2d if year2d <= 56 else 1900 + year2d, 1, 1) + timedelta(days=daynum)
-        line2 = tlefile.readline().rstrip()
-        tledict[norad_id] += ((tledate, line1, line2),)
-        line1 = tlefile.readline().rstrip()
-        
-    psqlin = subprocess.Popen(['psql', args.database, args.user,
-                               '--quiet',
-                               '--command', r'\timing off',
-                               '--command', '\\copy (SELECT * FROM ' + args.hotspots + ' WHERE ' + args.where + ' ORDER BY acq_datetime) TO STDOUT CSV HEADER'],
-                               stdout=subprocess.PIPE, encoding='UTF-8')
-
-    satcsv = csv.DictReader(psqlin.stdout)
-    
-    psqlout = subprocess.Popen(['psql', args.database, args.user,
-                                '--quiet',
-                                '--command', r'\timing off',
-                                '--command', r'\set on_error_stop 1'] +
-                              (['--command', 'DROP TABLE IF EXISTS ' + args.hotspots + '_' + args.suffix] if args.drop_table else []) +
-                               ['--command', 'CREATE TABLE ' + args.hotspots + '_' + args.suffix + ' AS TABLE ' + args.hotspots + ' WITH NO DATA',
-                                '--command', 'ALTER TABLE ' + args.hotspots + '_' + args.suffix + '     \
-                                                  ADD COLUMN pass_azimuth NUMERIC(8,5),                 \
-                                                  ADD COLUMN pass_elevation NUMERIC(8,5),               \
-                                                  ADD COLUMN pass_bearing NUMERIC(8,5),                 \
-                                                  ADD COLUMN pass_datetime TIMESTAMP WITHOUT TIME ZONE, \
-                                                  ADD COLUMN prev_azimuth NUMERIC(8,5),                 \
-                                                  ADD COLUMN prev_elevation NUMERIC(8,5),               \
-                                                  ADD COLUMN prev_datetime TIMESTAMP WITHOUT TIME ZONE, \
-                                                  ADD COLUMN next_azimuth NUMERIC(8,5),                 \
-                                                  ADD COLUMN next_elevation NUMERIC(8,5),               \
-                                                  ADD COLUMN next_datetime TIMESTAMP WITHOUT TIME ZONE',
-                                '--command', r'\copy ' + args.hotspots + '_' + args.suffix + ' FROM STDIN CSV HEADER',
-                                '--command', 'ALTER TABLE ' + args.hotspots + '_' + args.suffix + '     \
-                                                  DROP COLUMN IF EXISTS envelope,                       \
-                                                  ADD COLUMN envelope geometry GENERATED ALWAYS AS (ST_Rotate(ST_MakeEnvelope((ST_X(ST_Transform(ST_SetSRID(ST_MakePoint((longitude)::DOUBLE PRECISION, (latitude)::DOUBLE PRECISION), 4326), 28350)) - ((scan * (500)::NUMERIC))::DOUBLE PRECISION), (ST_Y(ST_Transform(ST_SetSRID(ST_MakePoint((longitude)::DOUBLE PRECISION, (latitude)::DOUBLE PRECISION), 4326), 28350)) - ((track * (500)::NUMERIC))::DOUBLE PRECISION), (ST_X(ST_Transform(ST_SetSRID(ST_MakePoint((longitude)::DOUBLE PRECISION, (latitude)::DOUBLE PRECISION), 4326), 28350)) + ((scan * (500)::NUMERIC))::DOUBLE PRECISION), (ST_Y(ST_Transform(ST_SetSRID(ST_MakePoint((longitude)::DOUBLE PRECISION, (latitude)::DOUBLE PRECISION), 4326), 28350)) + ((track * (500)::NUMERIC))::DOUBLE PRECISION), 28350), ((((- pass_bearing) * 3.1415926) / (180)::NUMERIC))::DOUBLE PRECISION, ST_Transform(ST_SetSRID(ST_MakePoint((longitude)::DOUBLE PRECISION, (latitude)::DOUBLE PRECISION), 4326), 28350))) STORED',
-                                '--command', 'ALTER TABLE ' + args.hotspots + '_' + args.suffix + '     \
-                                                  DROP COLUMN IF EXISTS envelope,                       \
-                                                  ADD COLUMN envelope geometry GENERATED ALWAYS AS (ST_Rotate(ST_MakeEnvelope((ST_X(ST_Transform(ST_SetSRID(ST_MakePoint((longitude)::DOUBLE PRECISION, (latitude)::DOUBLE PRECISION), 4326), 28350)) - ((scan * (500)::NUMERIC))::DOUBLE PRECISION), (ST_Y(ST_Transform(ST_SetSRID(ST_MakePoint((longitude)::DOUBLE PRECISION, (latitude)::DOUBLE PRECISION), 4326), 28350)) - ((track * (500)::NUMERIC))::DOUBLE PRECISION), (ST_X(ST_Transform(ST_SetSRID(ST_MakePoint((longitude)::DOUBLE PRECISION, (latitude)::DOUBLE PRECISION), 4326), 28350)) + ((scan * (500)::NUMERIC))::DOUBLE PRECISION), (ST_Y(ST_Transform(ST_SetSRID(ST_MakePoint((longitude)::DOUBLE PRECISION, (latitude)::DOUBLE PRECISION), 4326), 28350)) + ((track * (500)::NUMERIC))::DOUBLE PRECISION), 28350), ((((- pass_bearing) * 3.1415926) / (180)::NUMERIC))::DOUBLE PRECISION, ST_Transform(ST_SetSRID(ST_MakePoint((longitude)::DOUBLE PRECISION, (latitude)::DOUBLE PRECISION), 4326), 28350))) STORED',
-                                '--command', 'ALTER TABLE ' + args.hotspots + '_' + args.suffix + '     \
-                                                  ADD COLUMN id SERIAL'],
-                                stdin=subprocess.PIPE, encoding='UTF-8')
-    
-    satout = csv.DictWriter(psqlout.stdin, fieldnames = (satcsv.fieldnames or []) + ['pass_azimuth', 'pass_elevation', 'pass_bearing', 'pass_datetime', 'prev_azimuth', 'prev_elevation', 'prev_datetime', 'next_azimuth', 'next_elevation', 'next_datetime'])
-    
-    minelevation = 90
-    tleindexes = {}
-    lastdatetime = datetime(MINYEAR,1,1)
-    lastline1 = None
-    lastline2 = None
-    inrowcount = 0
-    for satline in satcsv:
-        thisdatetime = dateparser.parse(satline['acq_datetime'])
-        satcode = satcodes[satline['satellite']]
-        tletuples = tledict[satcode]
-        tleidx = tleindexes.get(satcode, 0)
+        passtimes[:,passidx] = basetimes + numpy.round((lower + upper) / 2 * 1e6).astype('timedelta64[us]')
+
+    (azimuths, elevations) = orb.get_observer_look(passtimes.ravel(), numpy.repeat(longitudes, len(candidates)), numpy.repeat(latitudes, len(candidates)), numpy.zeros(passtimes.size))
+    (lon1, lat1, alt1) = orb.get_lonlatalt(passtimes.ravel() - numpy.timedelta64(30, 's'))
+    (lon2, lat2, alt2) = orb.get_lonlatalt(passtimes.ravel() + numpy.timedelta64(30, 's'))
+    bearings = sphereBearing(lat1, lon1, lat2, lon2)
+
+    return (passtimes, azimuths.reshape(passtimes.shape), elevations.reshape(passtimes.shape), bearings.reshape(passtimes.shape))
+
+# Passes over every hotspot in a swath within 24 hours either side of its acquisition time
+def swathPasses(orb, thisdatetime, longitudes, latitudes):
+    return windowPasses(orb, thisdatetime - timedelta(hours=24), 48, longitudes, latitudes)
+
+# Select the visible pass nearest to each hotspot's acquisition time and the visible passes either
+# side of it. Returns arrays keyed by the names in passcolumns, with NaN or NaT where there is no
+# such pass, and the offset in seconds of each hotspot from its nearest pass.
+def nearestPasses(passtimes, azimuths, elevations, bearings, acqtimes):
+    passes = {column: numpy.full(len(acqtimes), numpy.datetime64('NaT', 'us') if column.endswith('_datetime') else numpy.nan) for column in passcolumns}
+    if passtimes is None:
+        return (passes, numpy.full(len(acqtimes), 999999.0))
+
+    offsets = (passtimes - acqtimes[:,None]) / numpy.timedelta64(1, 's')
+    visible = elevations >= 0
+    passidxs = numpy.argmin(numpy.where(visible, numpy.abs(offsets), numpy.inf), axis=1)
+    rowidxs = numpy.arange(len(acqtimes))
+    passfound = visible.any(axis=1)
+
+    passnums = numpy.arange(passtimes.shape[1])
+    prevvisible = visible & (passnums < passidxs[:,None])
+    nextvisible = visible & (passnums > passidxs[:,None])
+    previdxs = passtimes.shape[1] - 1 - numpy.argmax(prevvisible[:,::-1], axis=1)
+    nextidxs = numpy.argmax(nextvisible, axis=1)
+
+    for (prefix, idxs, found) in (('pass', passidxs, passfound),
+                                  ('prev', previdxs, prevvisible.any(axis=1)),
+                                  ('next', nextidxs, nextvisible.any(axis=1))):
+        passes[prefix + '_datetime'][found]  = passtimes[rowidxs, idxs][found]
+        passes[prefix + '_azimuth'][found]   = azimuths[rowidxs, idxs][found]
+        passes[prefix + '_elevation'][found] = elevations[rowidxs, idxs][found]
+
+    passes['pass_bearing'][passfound] = bearings[rowidxs, passidxs][passfound]
+
+    return (passes, numpy.where(passfound, offsets[rowidxs, passidxs], 999999.0))
+
+# Convert an array of pass values to a list of Python values, with None for NaN or NaT
+def columnValues(values):
+    if values.dtype.kind == 'M':
+        return values.tolist()
+    else:
+        return [None if value != value else value for value in values.tolist()]
+
+# Footprint of each hotspot as EWKB: a scan x track kilometre rectangle centred on the hotspot in
+# MGA zone 50, rotated to the bearing of the satellite pass. This is the same shape as the
+# generated envelope column, computed for a whole batch at once.
+ENVELOPE_SRID = 28350
+ENVELOPE_CORNERS = numpy.array([(-1, -1), (-1, 1), (1, 1), (1, -1), (-1, -1)])
+ENVELOPE_HEADER = numpy.frombuffer(struct.pack('<BIIII', 1, 0x20000003, ENVELOPE_SRID, 1, len(ENVELOPE_CORNERS)), dtype=numpy.uint8)
+envelopetransformer = None
+def hotspotEnvelopes(longitudes, latitudes, scans, tracks, bearings):
+    global envelopetransformer
+    if envelopetransformer is None:
+        envelopetransformer = Transformer.from_crs('EPSG:4326', 'EPSG:' + str(ENVELOPE_SRID), always_xy=True)
+
+    (x, y) = envelopetransformer.transform(longitudes, latitudes)
+    dx = ENVELOPE_CORNERS[None,:,0] * scans[:,None] * 500
+    dy = ENVELOPE_CORNERS[None,:,1] * tracks[:,None] * 500
+    (sin, cos) = (numpy.sin(numpy.radians(-bearings))[:,None], numpy.cos(numpy.radians(-bearings))[:,None])
+    coords = numpy.stack((x[:,None] + dx * cos - dy * sin, y[:,None] + dx * sin + dy * cos), axis=-1)
+
+    wkbs = numpy.concatenate((numpy.broadcast_to(ENVELOPE_HEADER, (len(coords), len(ENVELOPE_HEADER))),
+                              coords.astype('<f8').view(numpy.uint8).reshape(len(coords), -1)), axis=1)
+    valid = numpy.isfinite(coords).all(axis=(1, 2))
+    return [wkb.tobytes() if isvalid else None for (wkb, isvalid) in zip(wkbs, valid)]
+
+# Wrap a row writer so that it appends the envelope of each hotspot to its row
+def envelopeWriter(write, fieldnames):
+    idxs = [fieldnames.index(fieldname) for fieldname in ('longitude', 'latitude', 'scan', 'track', 'pass_bearing')]
+
+    def writeEnvelopes(rows):
+        rows = list(rows)
+        if rows:
+            envelopes = hotspotEnvelopes(*(numpy.array([numpy.nan if row[idx] is None else row[idx] for row in rows], dtype=float) for idx in idxs))
+            rows = [list(row) + [envelope] for (row, envelope) in zip(rows, envelopes)]
+        write(rows)
+
+    return writeEnvelopes
+
+satcodes = { 'N':     37849,
+            'Terra': 25994,
+            'Aqua':  27424 }
+
+passcolumns = ['pass_azimuth', 'pass_elevation', 'pass_bearing', 'pass_datetime', 'prev_azimuth', 'prev_elevation', 'prev_datetime', 'next_azimuth', 'next_elevation', 'next_datetime']
+
+# Pool of orbit propagators keyed by NORAD id and TLE epoch, so that interleaved hotspots from
+# different satellites do not rebuild their propagators. Least recently used entries are evicted.
+class OrbitalPool:
+    def __init__(self, maxsize=16):
+        self.maxsize   = maxsize
+        self.orbitals  = OrderedDict()
+        self.builds    = 0
+        self.reuses    = 0
+        self.evictions = 0
+
+    def get(self, norad_id, tletuple):
+        (tledate, line1, line2) = tletuple
+        key = (norad_id, tledate)
+        orb = self.orbitals.get(key)
+        if orb is None:
+            orb = Orbital("", line1=line1, line2=line2)
+            self.builds += 1
+            self.orbitals[key] = orb
+            if len(self.orbitals) > self.maxsize:
+                self.orbitals.popitem(last=False)
+                self.evictions += 1
+        else:
+            self.orbitals.move_to_end(key)
+            self.reuses += 1
+
+        return orb
+
+    def stats(self):
+        return f"orbital pool: {self.builds} builds, {self.reuses} reuses, {self.evictions} evictions"
+
+def readHotspots(hotspotdb, args, where):
+    return hotspotdb.read('SELECT * FROM ' + args.hotspots + ' WHERE ' + where + ' ORDER BY acq_datetime' + (' LIMIT ' + str(args.limit) if args.limit else ''),
+                          args.batch_size or args.fetch_size)
+
+# Split the hotspot query into shards of one satellite over a range of days. Only hotspots from
+# the same satellite need to be processed in time order, so shards can be annotated independently.
+def listShards(hotspotdb, args):
+    shards = []
+    for (satellite, mindatetime, maxdatetime) in hotspotdb.fetchall('SELECT satellite, MIN(acq_datetime), MAX(acq_datetime) FROM ' + args.hotspots + ' WHERE ' + args.where + ' GROUP BY satellite'):
+        start = mindatetime.replace(hour=0, minute=0, second=0, microsecond=0)
+        while start <= maxdatetime:
+            end = start + timedelta(days=args.shard_days)
+            shards += [(start, satellite, '(' + args.where + ") AND satellite = '" + satellite.replace("'", "''") + "'" +
+                                          " AND acq_datetime >= '" + str(start) + "' AND acq_datetime < '" + str(end) + "'")]
+            start = end
+
+    return [shard[2] for shard in sorted(shards)]
+
+# Commands to create the monthly partitions of the output table that the selected hotspots fall in
+def partitionCommands(hotspotdb, args, outtable):
+    (mindatetime, maxdatetime) = hotspotdb.fetchall('SELECT MIN(acq_datetime), MAX(acq_datetime) FROM ' + args.hotspots + ' WHERE ' + args.where)[0]
+    commands = []
+    if mindatetime is not None:
+        month = date(mindatetime.year, mindatetime.month, 1)
+        while month <= maxdatetime.date():
+            nextmonth = date(month.year + month.month // 12, month.month % 12 + 1, 1)
+            commands += ['CREATE TABLE IF NOT EXISTS ' + outtable + '_' + month.strftime('%Y%m') + ' PARTITION OF ' + outtable +
+                         " FOR VALUES FROM ('" + str(month) + "') TO ('" + str(nextmonth) + "')"]
+            month = nextmonth
+
+    return commands
+
+def annotateHotspots(args, tlestore, orbitalpool, infieldnames, inbatches, write):
+    passcache = PassCache(args.cache, maxsize=args.cache_size, resolution=args.cache_resolution) if args.cache else None
+
+    lastdatetimes = {}
+
+    def getOrbital(satellite, thisdatetime):
+        satcode = satcodes[satellite]
         # if not (thisdatetime >= lastdatetime):
         #     print(thisdatetime)
         #     print(lastdatetime)
-        assert(thisdatetime >= lastdatetime)
-        lastdatetime = thisdatetime
-        while tletuples[tleidx+1][0] <= thisdatetime - timedelta(hours = 12):
-            tleidx += 1
-        tleindexes[satcode] = tleidx
+        assert(thisdatetime >= lastdatetimes.get(satcode, datetime(MINYEAR,1,1)))
+        lastdatetimes[satcode] = thisdatetime
+        tletuple = tlestore.find(satcode, thisdatetime - timedelta(hours = 12))
+        return (orbitalpool.get(satcode, tletuple), tletuple[0])
 
-        tletuple = tletuples[tleidx]
-        line1 = tletuple[1]
-        line2 = tletuple[2]
+    def annotateRow(satline, thisdatetime):
+        (orb, tledate) = getOrbital(satline['satellite'], thisdatetime)
 
-        if line1 != lastline1 or line2 != lastline2:
-            orb = Orbital("", line1=line1, line2=line2)
-            lastline1 = line1
-            lastline2 = line2
+        getPasses = lambda start, hours, longitude, latitude: [next_pass[2] for next_pass in orb.get_next_passes(start, hours, longitude, latitude, 0, horizon=0)]
+        if passcache:
+            passdatetimes = passcache.get(satcodes[satline['satellite']], tledate, float(satline['longitude']), float(satline['latitude']), thisdatetime, getPasses)
+        else:
+            passdatetimes = getPasses(thisdatetime - timedelta(hours=24), 48, float(satline['longitude']), float(satline['latitude']))
 
-        passdatetimes = [next_pass[2] for next_pass in orb.get_next_passes(thisdatetime - timedelta(hours=24), 48, float(satline['longitude']), float(satline['latitude']), 0, horizon=0)]
-                     
         nearpasses = []
         leastoffset = 999999
         leastoffsetidx = None
@@ -168,40 +306,320 @@ def trackHotspotSatellite(arglist=None):
             nearpasses += [(max_elevation_time, azimuth, elevation)]
 
         if abs(leastoffset) > 600:
-            print("WARNING: offset=", leastoffset, "prev offset=", (nearpasses[leastoffsetidx-1][0] - thisdatetime).total_seconds() if leastoffsetidx > 0 else "", "next offset=", (nearpasses[leastoffsetidx+1][0] - thisdatetime).total_seconds() if leastoffsetidx < len(nearpasses)-1 else "", " satellite ", satline['satellite'])
+            print("WARNING: offset=", leastoffset, "prev offset=", (nearpasses[leastoffsetidx-1][0] - thisdatetime).total_seconds() if leastoffsetidx else "", "next offset=", (nearpasses[leastoffsetidx+1][0] - thisdatetime).total_seconds() if leastoffsetidx is not None and leastoffsetidx < len(nearpasses)-1 else "", " satellite ", satline['satellite'])
             #print("   ", satline)
-            
+
         if len(nearpasses):
             nearestpass = nearpasses[leastoffsetidx]
             satline['pass_datetime'] = nearestpass[0]
             satline['pass_azimuth']  = nearestpass[1]
             satline['pass_elevation']  = nearestpass[2]
-            
-            (lon1, lat1, alt1) = orb.get_lonlatalt(max_elevation_time - timedelta(seconds = 30))
-            (lon2, lat2, alt2) = orb.get_lonlatalt(max_elevation_time + timedelta(seconds = 30))
+
+            (lon1, lat1, alt1) = orb.get_lonlatalt(nearestpass[0] - timedelta(seconds = 30))
+            (lon2, lat2, alt2) = orb.get_lonlatalt(nearestpass[0] + timedelta(seconds = 30))
             point1 = (lon1, lat1)
             point2 = (lon2, lat2)
             # bearing = sphere.bearing(point1, point2)
-            bearing = geosphere.distance_bearing(lat1, lon1, lat2, lon2)[0]
+            bearing = geosphere.distance_bearing(lat1, lon1, lat2, lon2)[1]
             satline['pass_bearing'] = bearing
-            
+
             if leastoffsetidx > 0:
                 prevpass = nearpasses[leastoffsetidx - 1]
                 satline['prev_datetime'] = prevpass[0]
                 satline['prev_azimuth']  = prevpass[1]
                 satline['prev_elevation']  = prevpass[2]
-                
+
             if leastoffsetidx < len(nearpasses)-1:
                 nextpass = nearpasses[leastoffsetidx + 1]
                 satline['next_datetime'] = nextpass[0]
                 satline['next_azimuth']  = nextpass[1]
                 satline['next_elevation']  = nextpass[2]
-            
-        satout.writerow(satline)
-            
-        inrowcount += 1
-        if args.limit and inrowcount == args.limit:
-            break
+
+    def annotateSwath(satlines, thisdatetime):
+        (orb, tledate) = getOrbital(satlines[0]['satellite'], thisdatetime)
+
+        longitudes = numpy.array([float(satline['longitude']) for satline in satlines])
+        latitudes  = numpy.array([float(satline['latitude'])  for satline in satlines])
+        acqtimes   = numpy.full(len(satlines), numpy.datetime64(thisdatetime, 'us'))
+        (passes, leastoffsets) = nearestPasses(*swathPasses(orb, thisdatetime, longitudes, latitudes), acqtimes)
+
+        for rowidx in numpy.flatnonzero(numpy.abs(leastoffsets) > 600):
+            print("WARNING: offset=", leastoffsets[rowidx], " satellite ", satlines[rowidx]['satellite'])
+
+        for column in passcolumns:
+            for (satline, value) in zip(satlines, columnValues(passes[column])):
+                satline[column] = value
+
+    # Annotate a batch of CSV rows, held as columns of typed arrays, one swath at a time.
+    def annotateBatch(acqtimes, longitudes, latitudes, satellites):
+        (satnames, satidxs) = numpy.unique(satellites, return_inverse=True)
+        (passes, leastoffsets) = nearestPasses(None, None, None, None, acqtimes)
+
+        swathstarts = numpy.flatnonzero(numpy.r_[True, acqtimes[1:] != acqtimes[:-1]])
+        swathends   = numpy.r_[swathstarts[1:], len(acqtimes)]
+        for (start, end) in zip(swathstarts, swathends):
+            thisdatetime = acqtimes[start].tolist()
+            for satidx in numpy.unique(satidxs[start:end]):
+                idxs = start + numpy.flatnonzero(satidxs[start:end] == satidx)
+                (orb, tledate) = getOrbital(str(satnames[satidx]), thisdatetime)
+                (swathpasses, swathoffsets) = nearestPasses(*swathPasses(orb, thisdatetime, longitudes[idxs], latitudes[idxs]), acqtimes[idxs])
+                for column in passcolumns:
+                    passes[column][idxs] = swathpasses[column]
+                leastoffsets[idxs] = swathoffsets
+
+        for rowidx in numpy.flatnonzero(numpy.abs(leastoffsets) > 600):
+            print("WARNING: offset=", leastoffsets[rowidx], " satellite ", satellites[rowidx])
+
+        return passes
+
+    def writeSwaths(satlines, thisdatetime):
+        for satellite in set(satline['satellite'] for satline in satlines):
+            annotateSwath([satline for satline in satlines if satline['satellite'] == satellite], thisdatetime)
+
+        write([satline.get(fieldname) for fieldname in fieldnames] for satline in satlines)
+
+    inrowcount = 0
+    fieldnames = infieldnames + passcolumns
+    if args.compute_envelope:
+        write = envelopeWriter(write, fieldnames)
+    if args.batch_size:
+        (acqidx, lonidx, latidx, satidx) = (infieldnames.index(fieldname) for fieldname in ('acq_datetime', 'longitude', 'latitude', 'satellite'))
+        satrows = next(inbatches, [])
+        while satrows:
+            nextrows = next(inbatches, [])
+            # Hold back the last acquisition time so that a swath is not split between batches
+            if nextrows:
+                split = len(satrows)
+                while split > 0 and satrows[split-1][acqidx] == satrows[-1][acqidx]:
+                    split -= 1
+                if split > 0:
+                    nextrows = satrows[split:] + nextrows
+                    satrows = satrows[:split]
+
+            passes = annotateBatch(numpy.array([satrow[acqidx] for satrow in satrows], dtype='datetime64[us]'),
+                                   numpy.array([satrow[lonidx] for satrow in satrows], dtype=float),
+                                   numpy.array([satrow[latidx] for satrow in satrows], dtype=float),
+                                   numpy.array([satrow[satidx] for satrow in satrows]))
+
+            write([list(satrow) + list(values) for (satrow, values) in zip(satrows, zip(*(columnValues(passes[column]) for column in passcolumns)))])
+
+            inrowcount += len(satrows)
+            satrows = nextrows
+    else:
+        swathlines = []
+        swathdatetime = None
+        for satrows in inbatches:
+            outrows = []
+            for satrow in satrows:
+                satline = dict(zip(infieldnames, satrow))
+                thisdatetime = satline['acq_datetime']
+                if args.swath:
+                    if thisdatetime != swathdatetime:
+                        if swathlines:
+                            writeSwaths(swathlines, swathdatetime)
+                        swathlines = []
+                        swathdatetime = thisdatetime
+
+                    swathlines += [satline]
+                else:
+                    annotateRow(satline, thisdatetime)
+                    outrows += [[satline.get(fieldname) for fieldname in fieldnames]]
+
+                inrowcount += 1
+
+            if outrows:
+                write(outrows)
+
+        if swathlines:
+            writeSwaths(swathlines, swathdatetime)
+
+    if passcache:
+        passcache.close()
+        if args.verbosity >= 1:
+            print(passcache.stats(), file=sys.stderr)
+
+    if args.verbosity >= 2:
+        print(orbitalpool.stats(), file=sys.stderr)
+
+    return (fieldnames + (['envelope'] if args.compute_envelope else []), inrowcount)
+
+# Each worker process keeps its own orbital pool, which is reused by every shard it annotates.
+def initShard(args):
+    global shardargs, shardtlestore, shardorbitalpool
+    shardargs = args
+    shardtlestore = openTLEs(args.tlefile)
+    shardorbitalpool = OrbitalPool(args.orbital_pool_size)
+
+def annotateShard(where):
+    hotspotdb = HotspotDB(shardargs.database, shardargs.user)
+    (infieldnames, inbatches) = readHotspots(hotspotdb, shardargs, where)
+    outrows = []
+    (fieldnames, rowcount) = annotateHotspots(shardargs, shardtlestore, shardorbitalpool, infieldnames, inbatches, outrows.extend)
+    hotspotdb.close()
+
+    return (rowcount, outrows)
+
+def trackHotspotSatellite(arglist=None):
+
+    parser = ArgumentRecorder(description='Track satellite position, bearing, previous and next passdatetimes from hotspot data.',
+                              fromfile_prefix_chars='@')
+
+    parser.add_argument('-v', '--verbosity',  type=int, default=1, private=True)
+
+    parser.add_argument('-u', '--user',       type=str, required=True, help="PostgreSQL username")
+    parser.add_argument('-d', '--database',   type=str, required=True, help="PostgreSQL database")
+
+    parser.add_argument('-l', '--limit',      type=int, help='Limit number of rows to process')
+    
+    parser.add_argument('-t', '--tlefile',    type=str, required=True, help='File containing TLE data, as text or a binary TLE store')
+    parser.add_argument('-w', '--where',      type=str, default='True', help="'Where' clause to select hotspots")
+    parser.add_argument('-H', '--hotspots',   type=str, default='hotspots', help="Hotspot table name")
+    parser.add_argument('-s', '--suffix',     type=str, required=True, help="Suffix to append to 'hotspots' to get output table name")
+    parser.add_argument('-D', '--drop-table', action='store_true', help='Drop output table if it exists')
+    parser.add_argument('-I', '--incremental', action='store_true', help='Append hotspots newer than those already in the output table')
+    parser.add_argument('-P', '--partition',  action='store_true', help='Partition output table by month of acquisition time')
+    parser.add_argument('-E', '--compute-envelope', action='store_true', help='Compute hotspot envelopes here rather than in a generated column')
+    parser.add_argument('-e', '--events',     action='store_true', help='Cluster hotspots into fire events, adding an event_id column')
+    parser.add_argument('--event-distance',   type=float, default=2.0, help='Distance in km within which hotspots belong to the same fire event')
+    parser.add_argument('--event-hours',      type=float, default=24, help='Time in hours within which hotspots belong to the same fire event')
+    parser.add_argument('-S', '--swath',      action='store_true', help='Match passes for all hotspots in a satellite swath at once')
+    parser.add_argument('-j', '--jobs',       type=int, default=1, help='Number of processes to annotate hotspots in parallel')
+    parser.add_argument('--shard-days',       type=int, default=7, help='Number of days of hotspots per satellite for each parallel job')
+    parser.add_argument('--orbital-pool-size', type=int, default=16, help='Number of orbit propagators to keep for reuse')
+    parser.add_argument('--fetch-size',       type=int, default=10000, help='Number of hotspots to fetch from the database at a time')
+    parser.add_argument('-B', '--batch-size', type=int, help='Read and annotate hotspots in batches of this many rows, matching passes by swath')
+
+    parser.add_argument('-C', '--cache',      type=str, help='SQLite file to cache pass times across rows and runs')
+    parser.add_argument('--cache-size',       type=int, default=1000000, help='Maximum number of locations/dates to keep in the pass cache')
+    parser.add_argument('--cache-resolution', type=float, default=0.01, help='Size in degrees of pass cache grid cells')
     
+    parser.add_argument('--logfile',          type=str, help="Logfile, default is 'hotspots'_'suffix'.log", private=True)
+    parser.add_argument('--no-logfile',       action='store_true', help='Do not output descriptive comments')
+
+    args = parser.parse_args(arglist)
+
+    if not args.no_logfile:
+        if not args.logfile:
+            args.logfile = args.hotspots + '_' + args.suffix + '.log'
+
+        if os.path.exists(args.logfile):
+            shutil.move(args.logfile, args.logfile.split('/')[-1].rsplit('.',1)[0] + '.bak')
+            
+        logfile = open(args.logfile, 'w')
+        parser.write_comments(args, logfile, incomments=ArgumentHelper.separator())
+        logfile.close()
+
+    tlestore = openTLEs(args.tlefile)
+
+    hotspotdb = HotspotDB(args.database, args.user)
+
+    outtable = args.hotspots + '_' + args.suffix
+    appending = args.incremental and not args.drop_table and hotspotdb.tableExists(outtable)
+    if appending and 'id' not in hotspotdb.columns('SELECT * FROM ' + outtable):
+        # The run that created the table did not finish, so rebuild it
+        args.drop_table = True
+        appending = False
+
+    if appending:
+        # Only annotate hotspots from the latest acquisition time already in the output table onwards,
+        # skipping those at that time that are already there.
+        args.where = '(' + args.where + ") AND acq_datetime >= (SELECT COALESCE(MAX(acq_datetime), '-infinity') FROM " + outtable + ')' + \
+                     ' AND NOT EXISTS (SELECT 1 FROM ' + outtable + ' AS annotated' + \
+                     ' WHERE ' + ' AND '.join('annotated.' + column + ' = ' + args.hotspots + '.' + column for column in ('acq_datetime', 'satellite', 'latitude', 'longitude')) + ')'
+        # Envelopes must be written if the table was created with them computed here
+        args.compute_envelope = 'envelope' not in hotspotdb.generatedColumns(outtable)
+        args.events = 'event_id' in hotspotdb.columns('SELECT * FROM ' + outtable)
+        args.partition = hotspotdb.partitioned(outtable)
+        precommands  = partitionCommands(hotspotdb, args, outtable) if args.partition else []
+        postcommands = []
+    else:
+        precommands  = (['DROP TABLE IF EXISTS ' + outtable] if args.drop_table else []) + \
+                       (['CREATE TABLE ' + outtable + ' (LIKE ' + args.hotspots + ') PARTITION BY RANGE (acq_datetime)'] if args.partition else
+                        ['CREATE TABLE ' + outtable + ' AS TABLE ' + args.hotspots + ' WITH NO DATA']) + \
+                       ['ALTER TABLE ' + outtable + '     \
+                                ADD COLUMN pass_azimuth NUMERIC(8,5),                 \
+                                ADD COLUMN pass_elevation NUMERIC(8,5),               \
+                                ADD COLUMN pass_bearing NUMERIC(8,5),                 \
+                                ADD COLUMN pass_datetime TIMESTAMP WITHOUT TIME ZONE, \
+                                ADD COLUMN prev_azimuth NUMERIC(8,5),                 \
+                                ADD COLUMN prev_elevation NUMERIC(8,5),               \
+                                ADD COLUMN prev_datetime TIMESTAMP WITHOUT TIME ZONE, \
+                                ADD COLUMN next_azimuth NUMERIC(8,5),                 \
+                                ADD COLUMN next_elevation NUMERIC(8,5),               \
+                                ADD COLUMN next_datetime TIMESTAMP WITHOUT TIME ZONE' +
+                                (', DROP COLUMN IF EXISTS envelope, ADD COLUMN envelope geometry' if args.compute_envelope else '') +
+                                (', ADD COLUMN event_id INTEGER' if args.events else '')] + \
+                       (partitionCommands(hotspotdb, args, outtable) if args.partition else [])
+        postcommands = ([] if args.compute_envelope else
+                        ['ALTER TABLE ' + outtable + '     \
+                                DROP COLUMN IF EXISTS envelope,                       \
+                                ADD COLUMN envelope geometry GENERATED ALWAYS AS (ST_Rotate(ST_MakeEnvelope((ST_X(ST_Transform(ST_SetSRID(ST_MakePoint((longitude)::DOUBLE PRECISION, (latitude)::DOUBLE PRECISION), 4326), 28350)) - ((scan * (500)::NUMERIC))::DOUBLE PRECISION), (ST_Y(ST_Transform(ST_SetSRID(ST_MakePoint((longitude)::DOUBLE PRECISION, (latitude)::DOUBLE PRECISION), 4326), 28350)) - ((track * (500)::NUMERIC))::DOUBLE PRECISION), (ST_X(ST_Transform(ST_SetSRID(ST_MakePoint((longitude)::DOUBLE PRECISION, (latitude)::DOUBLE PRECISION), 4326), 28350)) + ((scan * (500)::NUMERIC))::DOUBLE PRECISION), (ST_Y(ST_Transform(ST_SetSRID(ST_MakePoint((longitude)::DOUBLE PRECISION, (latitude)::DOUBLE PRECISION), 4326), 28350)) + ((track * (500)::NUMERIC))::DOUBLE PRECISION), 28350), ((((- pass_bearing) * 3.1415926) / (180)::NUMERIC))::DOUBLE PRECISION, ST_Transform(ST_SetSRID(ST_MakePoint((longitude)::DOUBLE PRECISION, (latitude)::DOUBLE PRECISION), 4326), 28350))) STORED']) + \
+                       ['ALTER TABLE ' + outtable + '     \
+                                ADD COLUMN id SERIAL'] + \
+                       (['CREATE INDEX ON ' + outtable + ' (acq_datetime)'] if args.incremental else []) + \
+                       (['CREATE INDEX ON ' + outtable + ' (event_id)'] if args.events else []) + \
+                       (['CREATE INDEX ON ' + outtable + ' USING BRIN (acq_datetime)',
+                         'CREATE INDEX ON ' + outtable + ' USING GIST (envelope)'] if args.partition else [])
+
+    for command in precommands:
+        hotspotdb.execute(command)
+
+    fieldnames = hotspotdb.columns('SELECT * FROM ' + args.hotspots) + passcolumns + (['envelope'] if args.compute_envelope else [])
+    if args.jobs > 1:
+        shards = listShards(hotspotdb, args)
+
+    if args.events:
+        # Shards of different satellites over the same days may arrive out of time order
+        # New events are numbered after every event already in the output table, not only those
+        # of the hotspots it is seeded with
+        firstevent = hotspotdb.fetchall('SELECT COALESCE(MAX(event_id), 0) + 1 FROM ' + outtable)[0][0] if appending else 1
+        clusterer = EventClusterer(args.event_distance, timedelta(hours=args.event_hours),
+                                   lag=timedelta(days=args.shard_days) if args.jobs > 1 else timedelta(0), firstevent=firstevent)
+        if appending:
+            # Continue events from hotspots already in the output table
+            for (longitude, latitude, acqtime, event) in hotspotdb.fetchall('SELECT longitude, latitude, acq_datetime, event_id FROM ' + outtable +
+                                                                            " WHERE acq_datetime >= (SELECT COALESCE(MAX(acq_datetime), '-infinity') FROM " + outtable + ') - %s', (clusterer.window,)):
+                clusterer.add(float(longitude), float(latitude), acqtime, event=event)
+
+    with hotspotdb.copy(outtable, fieldnames + (['event_id'] if args.events else [])) as write:
+        if args.events:
+            write = eventWriter(write, fieldnames, clusterer)
+
+        if args.jobs > 1:
+            pool = multiprocessing.Pool(args.jobs, initializer=initShard, initargs=(args,))
+            inrowcount = 0
+            for (rowcount, rows) in pool.imap(annotateShard, shards):
+                if args.limit and inrowcount + rowcount >= args.limit:
+                    write(rows[:args.limit - inrowcount])
+                    pool.terminate()
+                    break
+
+                write(rows)
+                inrowcount += rowcount
+            else:
+                pool.close()
+
+            pool.join()
+        else:
+            indb = HotspotDB(args.database, args.user)
+            (infieldnames, inbatches) = readHotspots(indb, args, args.where)
+            annotateHotspots(args, tlestore, OrbitalPool(args.orbital_pool_size), infieldnames, inbatches, write)
+            indb.close()
+
+        if args.events:
+            write(None)
+
+    # Renumber hotspots already written whose events were later merged into older ones
+    if args.events:
+        merges = clusterer.merges()
+        if merges:
+            hotspotdb.execute('UPDATE ' + outtable + ' SET event_id = merges.event_id FROM unnest(%s::integer[], %s::integer[]) AS merges(old_id, event_id)' +
+                              ' WHERE ' + outtable + '.event_id = merges.old_id', ([old for (old, new) in merges], [new for (old, new) in merges]))
+
+    for command in postcommands:
+        hotspotdb.execute(command)
+
+    hotspotdb.close()
+
 if __name__ == '__main__':
     trackHotspotSatellite(None)